@@ -0,0 +1,166 @@
+from operator import itemgetter
+
+
+# Built-in aggregations declared by a script instead of reduce code, e.g. Aggregate = "sum".
+# Values of a key are folded into a partial aggregate on the map side, partials are shuffled
+# and merged by the reducer, final turns a partial into the result value.
+class Aggregation:
+    name = None
+
+    def init(self, value):
+        return value
+
+    def merge(self, a, b):
+        raise NotImplementedError()
+
+    def final(self, partial):
+        return partial
+
+
+class Sum(Aggregation):
+    name = "sum"
+
+    def merge(self, a, b):
+        return a + b
+
+
+class Count(Aggregation):
+    name = "count"
+
+    def init(self, value):
+        return 1
+
+    def merge(self, a, b):
+        return a + b
+
+
+class Min(Aggregation):
+    name = "min"
+
+    def merge(self, a, b):
+        return min(a, b)
+
+
+class Max(Aggregation):
+    name = "max"
+
+    def merge(self, a, b):
+        return max(a, b)
+
+
+# partial is [sum, count]
+class Mean(Aggregation):
+    name = "mean"
+
+    def init(self, value):
+        return [value, 1]
+
+    def merge(self, a, b):
+        return [a[0] + b[0], a[1] + b[1]]
+
+    def final(self, partial):
+        return partial[0] / partial[1]
+
+
+# xml-rpc and json turn tuples to lists, turn them back to hashable tuples
+def _hashable(value):
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+
+# number of distinct values, partial is list of distinct values
+class Distinct(Aggregation):
+    name = "distinct"
+
+    def init(self, value):
+        return [value]
+
+    def merge(self, a, b):
+        return list(set(map(_hashable, a)) | set(map(_hashable, b)))
+
+    def final(self, partial):
+        return len(set(map(_hashable, partial)))
+
+
+aggregations = {
+    Sum.name: Sum,
+    Count.name: Count,
+    Min.name: Min,
+    Max.name: Max,
+    Mean.name: Mean,
+    Distinct.name: Distinct,
+}
+
+
+# aggregation declared by the script module, None if the script has its own reduce code
+def get_aggregation(mod):
+    name = getattr(mod, "Aggregate", None)
+    if name is None:
+        return None
+    if name not in aggregations:
+        raise ValueError("Unknown aggregation " + str(name))
+    return aggregations[name]()
+
+
+# fold (key, partial) tuples into dict key -> partial
+def aggregate(aggregation, tuples, partials=None):
+    partials = {} if partials is None else partials
+    for key, partial in tuples:
+        key = _hashable(key)
+        partials[key] = aggregation.merge(partials[key], partial) if key in partials else partial
+    return partials
+
+
+# Collector of the map side: values are folded into partials in a dict and the partials are
+# passed to the output collector when the dict holds max_keys keys and at the end of the map
+class HashAggregator:
+    def __init__(self, aggregation, collector, max_keys=10000):
+        self.aggregation = aggregation
+        self.collector = collector
+        self.max_keys = max_keys
+        self.partials = {}
+        self.count = 0  # number of emitted tuples
+
+    def emit(self, key, value):
+        self.count += 1
+        key = _hashable(key)
+        partial = self.aggregation.init(value)
+        if key in self.partials:
+            self.partials[key] = self.aggregation.merge(self.partials[key], partial)
+        else:
+            self.partials[key] = partial
+            if len(self.partials) >= self.max_keys:
+                self.flush()
+
+    # keys, values - NumPy arrays of the batch contract
+    def emit_batch(self, keys, values):
+        for key, value in zip(keys.tolist(), values.tolist()):
+            self.emit(key, value)
+
+    def flush(self):
+        for key, partial in self.partials.items():
+            self.collector.emit(key, partial)
+        self.partials = {}
+
+    def save(self, out_dir):
+        self.flush()
+        self.collector.save(out_dir)
+
+
+# combiner of the output collector which merges partials of runs spilled by HashAggregator
+class AggregateCombiner:
+    def __init__(self, aggregation):
+        self.aggregation = aggregation
+
+    def run_reduce(self, data):
+        return sorted(aggregate(self.aggregation, data).items(), key=itemgetter(0))
+
+
+# reduce side: merge partials of all map outputs of the region in a dict
+# Return list of (key, result value) sorted by key
+def reduce_partials(aggregation, streams):
+    partials = {}
+    for stream in streams:
+        aggregate(aggregation, stream, partials)
+    return [(key, aggregation.final(partials[key])) for key in sorted(partials)]
@@ -0,0 +1,61 @@
+from itertools import islice
+
+import numpy as np
+
+# Batch contract of scripts over NumPy arrays, used instead of per record calls if the script defines it:
+# Mapper.map_batch(data) returns (keys, values) - arrays of equal length,
+# Reducer.reduce_batch(keys, values) and Combiner.reduce_batch get keys sorted, all values of a key
+# in one call, and return (keys, values) of reduced rows.
+BATCH_SIZE = 1 << 20  # rows of a block passed to reduce_batch
+
+
+# rows of a batch grouped by region and sorted by key within a region
+# parts - region index of every row
+# Return list of (region index, keys, values) of non-empty regions
+def split_regions(parts, keys, values, rds_count):
+    order = np.lexsort((keys, parts))
+    parts, keys, values = parts[order], keys[order], values[order]
+    bounds = np.searchsorted(parts, np.arange(rds_count + 1))
+    return [(i, keys[bounds[i]:bounds[i + 1]], values[bounds[i]:bounds[i + 1]])
+            for i in range(rds_count) if bounds[i] < bounds[i + 1]]
+
+
+# indices where groups of equal keys start in sorted keys, for segment operations like np.add.reduceat
+def group_starts(keys):
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.intp)
+    return np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+
+
+# sorted stream of tuples as (keys, values) arrays of about size rows,
+# rows of one key are never split between blocks
+def sorted_blocks(tuples, size=BATCH_SIZE):
+    it = iter(tuples)
+    keys, values = [], []
+    while True:
+        block = list(islice(it, size))
+        if len(block) == 0:
+            break
+        keys += [t[0] for t in block]
+        values += [t[1] for t in block]
+
+        # rows of the last key may continue in the next block
+        cut = len(keys)
+        while cut > 0 and keys[cut - 1] == keys[-1]:
+            cut -= 1
+        if cut > 0:
+            yield np.array(keys[:cut]), np.array(values[:cut])
+            keys, values = keys[cut:], values[cut:]
+
+    if len(keys) > 0:
+        yield np.array(keys), np.array(values)
+
+
+# apply reduce_batch of the reducer to sorted stream of tuples
+# Return list of reduced tuples
+def reduce_sorted(reducer, tuples, size=BATCH_SIZE):
+    result = []
+    for keys, values in sorted_blocks(tuples, size):
+        keys, values = reducer.reduce_batch(keys, values)
+        result.extend(zip(keys.tolist(), values.tolist()))
+    return result
@@ -6,3 +6,14 @@ def load(config_path):
     config = ConfigParser()
     config.read(config_path)
     return dict(config.items("YAMR"))
+
+
+# client of the file system selected by "fs" option: dfs (default) or local
+# local file system keeps files in fs_dir shared by all workers of one host
+def create_fs(opts):
+    if opts.get("fs", "dfs") == "local":
+        from fake_fs import FakeFS, CHUNK_SIZE
+        return FakeFS(opts.get("fs_dir", "/var/fake_fs"), int(opts.get("fs_chunk_size", CHUNK_SIZE)))
+
+    import yadfs.client.client
+    return yadfs.client.client.Client()
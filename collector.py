@@ -0,0 +1,118 @@
+import heapq
+import os
+import shutil
+import time
+from itertools import groupby
+from operator import itemgetter
+
+
+# Collector of the map output.
+# Emitted tuples are collected in a pending buffer which is partitioned with one partition_batch
+# call when it is full, tuples go to bounded buffers of their regions.
+# When a region buffer is full it is sorted (and combined if the job has a combiner)
+# and spilled to disk as a sorted run. At the end of the task runs of each region
+# are merged into a single sorted region file.
+class OutputCollector:
+    def __init__(self, rds_count, partitioner, serializer, spill_dir, buffer_size=10000, combiner=None):
+        self.rds_count = rds_count
+        self.serializer = serializer
+        self.partitioner = partitioner
+        self.spill_dir = spill_dir
+        self.buffer_size = buffer_size
+        self.combiner = combiner
+        self.count = 0  # number of emitted tuples
+        self.spill_time = 0.0  # seconds spent on sorting and saving runs
+        self.partition_time = 0.0  # seconds spent on partitioning and sorting batches
+        self.pending = []  # emitted tuples which are not partitioned yet
+        self.buffers = {}
+        self.runs = {}
+        for i in range(1, rds_count + 1):
+            self.buffers[i] = []
+            self.runs[i] = []
+
+    def emit(self, key, value):
+        self.pending.append((key, value))
+        self.count += 1
+
+        if len(self.pending) >= self.buffer_size:
+            self._partition_pending()
+
+    # move pending tuples to buffers of their regions and spill full buffers
+    def _partition_pending(self):
+        if len(self.pending) == 0:
+            return
+
+        start = time.perf_counter()
+        parts = self.partitioner.partition_batch([t[0] for t in self.pending], self.rds_count)
+        buffers = self.buffers
+        for t, part in zip(self.pending, parts):
+            buffers[part + 1].append(t)
+        self.pending = []
+        self.partition_time += time.perf_counter() - start
+
+        for region in range(1, self.rds_count + 1):
+            if len(buffers[region]) >= self.buffer_size:
+                self.spill(region)
+
+    # keys, values - NumPy arrays of a batch of the batch contract, see batch.py
+    # the batch is partitioned and sorted at once and every region of it is saved as a sorted run,
+    # combined before if the combiner has reduce_batch
+    def emit_batch(self, keys, values):
+        from batch import split_regions
+        start = time.perf_counter()
+        parts = self.partitioner.partition_array(keys, self.rds_count)
+        regions = split_regions(parts, keys, values, self.rds_count)
+        self.partition_time += time.perf_counter() - start
+        start = time.perf_counter()
+        for i, k, v in regions:
+            if self.combiner is not None and hasattr(self.combiner, "reduce_batch"):
+                k, v = self.combiner.reduce_batch(k, v)
+            self._save_run(i + 1, zip(k.tolist(), v.tolist()))
+        self.spill_time += time.perf_counter() - start
+        self.count += len(keys)
+
+    def _sorted_buffer(self, region):
+        buf = self.buffers[region]
+        buf.sort(key=itemgetter(0))
+        if self.combiner is not None and len(buf) > 0:
+            buf = self.combiner.run_reduce(buf)
+            buf.sort(key=itemgetter(0))
+        return buf
+
+    # sort buffer of the region and save it to disk as a new run
+    def spill(self, region):
+        start = time.perf_counter()
+        self._save_run(region, self._sorted_buffer(region))
+        self.buffers[region] = []
+        self.spill_time += time.perf_counter() - start
+
+    def _save_run(self, region, tuples):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = self.spill_dir + "/" + str(region) + "_" + str(len(self.runs[region]))
+        self.serializer.dump(tuples, path)
+        self.runs[region].append(path)
+
+    def _combine_stream(self, tuples):
+        for _, group in groupby(tuples, key=itemgetter(0)):
+            yield from self.combiner.run_reduce(list(group))
+
+    # iterator over sorted tuples of the region: spilled runs merged with the rest of the buffer
+    def merge(self, region):
+        self._partition_pending()
+        streams = [self.serializer.load(path) for path in self.runs[region]]
+        streams.append(iter(self._sorted_buffer(region)))
+        merged = heapq.merge(*streams, key=itemgetter(0))
+
+        # combiner of the batch contract only combines batches, runs are merged as they are
+        if self.combiner is not None and hasattr(self.combiner, "run_reduce") and len(self.runs[region]) > 0:
+            return self._combine_stream(merged)
+        return merged
+
+    # merge every region to file out_dir/region and remove spilled runs
+    def save(self, out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+        for region in range(1, self.rds_count + 1):
+            self.serializer.dump(self.merge(region), out_dir + "/" + str(region))
+            self.buffers[region] = []
+
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
@@ -37,10 +37,16 @@ class MapStatus:
 
 class TaskStatus:
     accepted = 200
+    queued = 201  # waits in admission queue of JT
+    sampling = 205
     mapping = 210
     mapping_done = 220
     reducing = 230
     task_done = 240
+    failed = 500
+
+    running = (sampling, mapping, mapping_done, reducing)
+    ended = (task_done, failed)
 
 
 class ReduceStatus:
@@ -1,43 +1,173 @@
+import mmap
 import os
+import re
+import uuid
 
 from enums import Status
 
+CHUNK_SIZE = 64 * 1024 * 1024  # size of chunks of files uploaded with create_file
+COPY_BUFFER = 1024 * 1024
 
+
+# copy count bytes of src starting at offset to the current position of dst
+# kernel copies data without passing it through user space if the file systems support it
+def copy_range(src, dst, offset, count):
+    while count > 0:
+        try:
+            n = os.copy_file_range(src, dst, count, offset)
+        except (AttributeError, OSError):
+            try:
+                n = os.sendfile(dst, src, offset, count)
+            except (AttributeError, OSError):
+                n = os.write(dst, os.pread(src, min(count, COPY_BUFFER), offset))
+        if n == 0:
+            break
+        offset += n
+        count -= n
+
+
+# bytes are decoded with surrogateescape, so any content survives get_chunk and save
+def decode(data):
+    return str(data, 'utf-8', 'surrogateescape')
+
+
+def encode(data):
+    if isinstance(data, str):
+        return data.encode('utf-8', 'surrogateescape')
+    return data
+
+
+# offset of the start of the utf-8 character at or before end of the file, so that
+# a multi-byte character is not split between chunks which are decoded separately
+# start - offset of the chunk, the chunk keeps at least one byte
+def char_boundary(fd, start, end):
+    for _ in range(3):
+        if end - 1 <= start or os.pread(fd, 1, end)[0] & 0xC0 != 0x80:
+            break
+        end -= 1
+    return end
+
+
+# DFS backed by a directory shared by all processes on one host, selected by "fs = local" in config.
+# Like DFS, a file uploaded with create_file is stored as chunks <file path>_<number>,
+# files written with save are stored as is.
 class FakeFS:
-    def __init__(self, base_dir="/var/fake_fs"):
+    def __init__(self, base_dir="/var/fake_fs", chunk_size=CHUNK_SIZE):
         self.base_dir = base_dir
+        self.chunk_size = chunk_size
 
-    def get_chunk(self, path):
+    def _chunk_paths(self, path):
+        dir_path, name = os.path.split(self.base_dir + path)
+        if not os.path.isdir(dir_path):
+            return []
+        pattern = re.compile(re.escape(name) + r"_(\d+)$")
+        numbers = [int(m.group(1)) for m in map(pattern.match, os.listdir(dir_path)) if m is not None]
+        return [path + "_" + str(n) for n in sorted(numbers)]
+
+    # data of the file, pages of the file are mapped instead of read through a buffer
+    # offset, size - range of bytes to read, till the end of the file if size is None
+    def get_chunk(self, path, offset=0, size=None):
         full_path = self.base_dir + path
         if not os.path.isfile(full_path):
             return {'status': Status.not_found}
 
-        data = None
-        with open(full_path, 'r') as f:
-            data = f.read()
+        with open(full_path, 'rb') as f:
+            length = os.fstat(f.fileno()).st_size
+            end = length if size is None else min(length, offset + size)
+            if offset >= end:
+                return {'status': Status.ok, 'data': ""}
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                with memoryview(m)[offset:end] as view:
+                    data = decode(view)
 
         return {'status': Status.ok, 'data': data}
 
+    # chunks of the file and their locations, every worker reaches the shared directory
+    def path_status(self, path):
+        chunks = self._chunk_paths(path)
+        if len(chunks) == 0 and os.path.isfile(self.base_dir + path):
+            chunks = [path]
+        if len(chunks) == 0:
+            return {'status': Status.not_found, 'chunks': {}}
+        return {'status': Status.ok, 'chunks': {chunk: "" for chunk in chunks}}
+
+    # copy the file or concatenation of its chunks to local path
     def download_to(self, v_path, l_path):
         full_path = self.base_dir + v_path
-        if not os.path.isfile(full_path):
+        paths = [v_path] if os.path.isfile(full_path) else self._chunk_paths(v_path)
+        if len(paths) == 0:
             return {'status': Status.not_found}
 
-        data = None
-        with open(full_path, 'r') as f:
-            data = f.read()
-
         os.makedirs(os.path.dirname(l_path), exist_ok=True)
-        with open(l_path, "w") as f:
-            f.write(data)
+        fd = os.open(l_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            for path in paths:
+                src = os.open(self.base_dir + path, os.O_RDONLY)
+                try:
+                    copy_range(src, fd, 0, os.fstat(src).st_size)
+                finally:
+                    os.close(src)
+        finally:
+            os.close(fd)
 
         return {'status': Status.ok}
 
+    # data - str or bytes
+    # file is replaced atomically, so concurrent readers see either old or new content
     def save(self, data, path):
         full_path = self.base_dir + path
 
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        with open(full_path, 'w+') as f:
-            f.write(data)
+        tmp_path = full_path + "." + str(uuid.uuid4())
+        with open(tmp_path, 'wb') as f:
+            f.write(encode(data))
+        os.replace(tmp_path, full_path)
+
+        return {'status': Status.ok}
+
+    # upload local file to directory remote_path as chunks of at most chunk_size bytes,
+    # chunks are cut on boundaries of utf-8 characters
+    def create_file(self, path, remote_path):
+        if not os.path.isfile(path):
+            return {'status': Status.not_found}
+
+        v_path = remote_path.rstrip("/") + "/" + os.path.basename(path)
+        os.makedirs(os.path.dirname(self.base_dir + v_path), exist_ok=True)
+        src = os.open(path, os.O_RDONLY)
+        try:
+            length = os.fstat(src).st_size
+            offset = 0
+            n = 0
+            while offset < length or n == 0:
+                end = min(offset + self.chunk_size, length)
+                if end < length:
+                    end = char_boundary(src, offset, end)
+                chunk_path = self.base_dir + v_path + "_" + str(n)
+                fd = os.open(chunk_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    copy_range(src, fd, offset, end - offset)
+                finally:
+                    os.close(fd)
+                offset = end
+                n += 1
+        finally:
+            os.close(src)
 
-        return {'status': Status.ok}
\ No newline at end of file
+        return {'status': Status.ok}
+
+    # Return (status, content of the file or its chunks)
+    def get_file_content(self, path):
+        r = self.get_chunk(path)
+        if r['status'] == Status.ok:
+            return Status.ok, r['data']
+
+        chunks = self._chunk_paths(path)
+        if len(chunks) == 0:
+            return Status.not_found, None
+        return Status.ok, "".join(self.get_chunk(chunk)['data'] for chunk in chunks)
+
+    def list_dir(self, path):
+        full_path = self.base_dir + path
+        if not os.path.isdir(full_path):
+            return {'status': Status.not_found, 'items': []}
+        return {'status': Status.ok, 'items': sorted(os.listdir(full_path))}
@@ -1,10 +1,50 @@
-import binascii
+import zlib
+
+
+# integral floats are equal to ints and are grouped with them by reducers, so they are hashed as ints,
+# e.g. key 1.0 of a float array goes to the region of key 1 emitted by another map
+def _canonical(key):
+    if type(key) is float and key.is_integer():
+        return int(key)
+    return key
 
 
 class HashPartitioner:
+    # algorithm - "legacy" keeps bucket assignments of the original hash of key's utf-8 bytes,
+    # "crc32" hashes key with fixed width crc32, which is fast and stable between processes
+    def __init__(self, algorithm="legacy"):
+        if algorithm == "legacy":
+            self._hash = self._legacy_hash
+        elif algorithm == "crc32":
+            self._hash = self._crc32_hash
+        else:
+            raise ValueError("Unknown partitioner " + str(algorithm))
+        self.algorithm = algorithm
+
     def get_partition(self, key, value, rds_count):
-        b = str(key).encode('utf-8')
-        hex = binascii.hexlify(b)
-        n = int(hex, 16)
+        return self._hash(key) % rds_count
+
+    # partitions of all keys in one call
+    def partition_batch(self, keys, rds_count):
+        h = self._hash
+        return [h(k) % rds_count for k in keys]
+
+    # partitions of NumPy array of keys, keys are hashed by the hash of the partitioner once per distinct key,
+    # so a key goes to the same region whether it is emitted in a batch or record by record
+    def partition_array(self, keys, rds_count):
+        import numpy as np
+        distinct, inverse = np.unique(keys, return_inverse=True)
+        return np.array(self.partition_batch(distinct.tolist(), rds_count), dtype=np.intp)[inverse]
+
+    # key bytes read as one big integer
+    @staticmethod
+    def _legacy_hash(key):
+        key = _canonical(key)
+        return int.from_bytes(str(key).encode('utf-8'), 'big')
 
-        return n % rds_count
\ No newline at end of file
+    @staticmethod
+    def _crc32_hash(key):
+        key = _canonical(key)
+        if isinstance(key, bytes):
+            return zlib.crc32(key)
+        return zlib.crc32(str(key).encode('utf-8'))
@@ -0,0 +1,153 @@
+import json
+import re
+
+from enums import Status
+
+
+# DFS stores chunks of a file as <file path>_<number>
+# Return (file path, number) or (chunk path, None) if the path does not follow the naming
+def parse_chunk_path(chunk_path):
+    m = re.match(r"^(.*)_(\d+)$", chunk_path)
+    if m is None:
+        return chunk_path, None
+    return m.group(1), int(m.group(2))
+
+
+# Chunk of a file with the beginning of next chunks which completes the last record of the chunk.
+# A record belongs to the chunk where it starts, so a chunk skips the record continued
+# from the previous chunk and reads the following chunks till the end of its last record.
+# number - number of the chunk in the file, None if the chunk is the whole file
+# tail - data of next chunks which completes the last record, None if the chunk is the last one
+class Split:
+    def __init__(self, data, number=None, tail=None):
+        self.data = data
+        self.number = number
+        self.tail = tail
+
+    @property
+    def first(self):
+        return not self.number
+
+
+# records separated by new lines, new line is not included in a record
+class TextLines:
+    def records(self, split):
+        data = split.data
+        start = 0
+        if not split.first:
+            # line which starts in the previous chunk belongs to it
+            start = data.find("\n") + 1
+            if start == 0:
+                return
+
+        end = data.find("\n", start)
+        while end != -1:
+            yield self.parse(data[start:end])
+            start = end + 1
+            end = data.find("\n", start)
+
+        # if there is the next chunk, the line starting at its beginning belongs to this chunk
+        last = data[start:] + (split.tail or "")
+        if len(last) > 0 or split.tail is not None:
+            yield self.parse(last)
+
+    def parse(self, line):
+        return line
+
+    def needs_tail(self, split):
+        return True
+
+    # next_data - data of the next chunk
+    # Return part of next_data which continues the last record and True if the record ends in it
+    def continuation(self, split, next_data):
+        end = next_data.find("\n")
+        if end == -1:
+            return next_data, False
+        return next_data[:end], True
+
+
+# every line is a json document, empty lines are skipped
+class JsonLines(TextLines):
+    def records(self, split):
+        for record in super().records(split):
+            if record is not None:
+                yield record
+
+    def parse(self, line):
+        if len(line.strip()) == 0:
+            return None
+        return json.loads(line)
+
+
+# records of record_size characters
+# chunk_size - size of all chunks of a file but the last one, if it is not a multiple of record_size
+# records cross chunks, None if every chunk starts at a record
+class FixedWidth:
+    def __init__(self, record_size, chunk_size=None):
+        if record_size <= 0:
+            raise ValueError("Record size must be positive")
+        self.record_size = record_size
+        self.chunk_size = chunk_size
+
+    def _start(self, split):
+        if self.chunk_size is None or split.first:
+            return 0
+        return -(split.number * self.chunk_size) % self.record_size
+
+    def _partial(self, split):
+        return (len(split.data) - self._start(split)) % self.record_size
+
+    def records(self, split):
+        data = split.data
+        start = self._start(split)
+        while start + self.record_size <= len(data):
+            yield data[start:start + self.record_size]
+            start += self.record_size
+
+        last = data[start:] + (split.tail or "")
+        if len(last) > 0:
+            yield last
+
+    def needs_tail(self, split):
+        return self._partial(split) > 0
+
+    def continuation(self, split, next_data):
+        need = self.record_size - self._partial(split) - len(split.tail or "")
+        return next_data[:need], len(next_data) >= need
+
+
+# input format by name: lines, json_lines or fixed:<record size>[:<chunk size>]
+def get_input_format(spec):
+    name, _, params = spec.partition(":")
+    if name == "lines":
+        return TextLines()
+    if name == "json_lines":
+        return JsonLines()
+    if name == "fixed":
+        sizes = [int(p) for p in params.split(":")]
+        return FixedWidth(*sizes)
+
+    raise ValueError("Unknown input format " + spec)
+
+
+# read the chunk of a DFS file and the beginning of next chunks which completes its last record
+# fs - client of DFS
+# data - data of the chunk
+# Return Split
+def read_split(fs, input_format, chunk_path, data):
+    file_path, number = parse_chunk_path(chunk_path)
+    split = Split(data, number)
+    if number is None or not input_format.needs_tail(split):
+        return split
+
+    n = number + 1
+    while True:
+        r = fs.get_chunk(file_path + "_" + str(n))
+        if r['status'] != Status.ok:
+            return split
+
+        more, done = input_format.continuation(split, r['data'])
+        split.tail = (split.tail or "") + more
+        if done:
+            return split
+        n += 1
@@ -1,11 +1,22 @@
 #!/usr/bin/env python3
 
 import sys
+import os
+import json
 import _thread
 import threading
 import uuid
 import time
+import random
+import heapq
+import itertools
+import statistics
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+from urllib.parse import urlsplit
+from socketserver import ThreadingMixIn
 from xmlrpc.server import SimpleXMLRPCServer
 from xmlrpc.client import ServerProxy
 
@@ -13,250 +24,982 @@ from os.path import dirname
 import socket
 
 sys.path.append(dirname(dirname(__file__)))
-from yadfs.client.client import Client
-from enums import Status, TaskStatus, MapStatus
+import cfg
+from enums import Status, TaskStatus, MapStatus, ReduceStatus
+from total_order_partitioner import compute_split_points
+from input_format import get_input_format
+from serialization import get_codec
+from metrics import Metrics
+
+
+# hostname of an address, resolved to ip so that addresses given by names and ips can be compared
+@lru_cache(maxsize=None)
+def host_of(addr):
+    host = urlsplit(addr).hostname if "://" in addr else addr.split(":")[0]
+    try:
+        return socket.gethostbyname(host)
+    except OSError:
+        return host
+
+
+# path_status of DFS gives location of a chunk as address of chunk server or list of them
+def chunk_hosts(locations):
+    if isinstance(locations, str):
+        locations = [locations]
+    if not isinstance(locations, (list, tuple)):
+        return set()
+    return set(host_of(addr) for addr in locations if isinstance(addr, str))
 
 
 class Chunk:
-    def __init__(self, path, status, mapper):
+    def __init__(self, path, status, mapper, hosts=None):
         self.path = path
         self.status = status
         self.mapper = mapper
         self.map_path = ""
+        self.hosts = hosts or set()  # hosts of chunk servers which store the chunk
+        self.pending_since = time.time()  # when the chunk started waiting for a mapper
+        self.started = None  # when the first attempt was dispatched
+        self.attempts = []  # workers which are mapping the chunk, more than one if it was speculated
+        self.failures = 0  # number of failed attempts
+
+    def reset(self):
+        self.status = MapStatus.accepted
+        self.pending_since = time.time()
+        self.attempts = []
+
+    @property
+    def done(self):
+        return self.status == MapStatus.map_applied
+
+    @property
+    def label(self):
+        return self.path
+
+
+class Region:
+    def __init__(self, number):
+        self.number = number
+        self.status = ReduceStatus.accepted
+        self.reducer = ""
+        self.result_path = ""  # DFS path of result saved by the attempt which completed the region
+        self.started = None
+        self.attempts = []
+        self.failures = 0
+
+    def reset(self):
+        self.status = ReduceStatus.accepted
+        self.attempts = []
+
+    @property
+    def done(self):
+        return self.status == ReduceStatus.finished
+
+    @property
+    def label(self):
+        return str(self.number)
 
 
 class Task:
-    def __init__(self, input, script, chunks, rds_count):
+    def __init__(self, input, script, chunks, rds_count, total_order=False, priority=1, input_format=None,
+                 codec=None):
         self.input = input
         self.script = script
+        self.total_order = total_order
+        self.input_format = input_format  # name of input format, map script gets whole chunks if None
+        self.codec = codec  # spec of codec of map outputs and results, not compressed if None
+        # raw and stored sizes of compressed map outputs and results: map_raw, map_stored, result_raw, result_stored
+        self.bytes = Counter()
+        # metrics sent by attempts which completed chunks and regions, by kind: map, reduce
+        self.metrics = {'map': Metrics(), 'reduce': Metrics()}
+        self.created = time.time()
+        self.finished = None  # time when the task is done or failed
+        self.weight = priority  # share of workers of the task relative to other running tasks
+        self.split_points = None
         self.chunks = []
-        for chunk_path, _ in chunks.items():
-            self.chunks.append(Chunk(chunk_path, MapStatus.accepted, ""))
+        self.chunk_index = {}  # chunk path -> chunk
+        # chunks waiting for a mapper in order of pending_since, in total and by hosts of their chunk servers
+        self.pending = {}
+        self.pending_by_host = {}
+        for chunk_path, locations in chunks.items():
+            chunk = Chunk(chunk_path, MapStatus.accepted, "", chunk_hosts(locations))
+            self.chunks.append(chunk)
+            self.chunk_index[chunk_path] = chunk
+            self.add_pending(chunk)
         self.status = TaskStatus.accepted
         self.rds_count = rds_count
+        self.regions = {}
+        self.local_maps = 0  # number of chunks mapped on the host of their chunk server
+        self.remote_maps = 0
+        self.map_durations = []  # seconds spent on completed chunks, used to detect stragglers
+        self.reduce_durations = []
 
     def get_chunk(self, chunk_path):
-        for chunk in self.chunks:
-            if chunk_path == chunk.path:
-                return chunk
-
+        return self.chunk_index.get(chunk_path)
+
+    def add_pending(self, chunk):
+        self.pending[chunk.path] = chunk
+        for host in chunk.hosts:
+            self.pending_by_host.setdefault(host, {})[chunk.path] = chunk
+
+    # chunk is dispatched to a mapper
+    def take_chunk(self, chunk):
+        if self.pending.pop(chunk.path, None) is None:
+            return
+        for host in chunk.hosts:
+            chunks = self.pending_by_host[host]
+            chunks.pop(chunk.path, None)
+            if len(chunks) == 0:
+                del self.pending_by_host[host]
+
+    def reset_chunk(self, chunk):
+        chunk.reset()
+        self.add_pending(chunk)
+
+    # chunks wait for local workers from the moment mapping starts, not from creation of the task
+    def start_mapping(self):
+        self.status = TaskStatus.mapping
+        now = time.time()
+        for chunk in self.pending.values():
+            chunk.pending_since = now
+
+    # chunks mapped by the worker are lost, running chunks are reset
+    # unless another attempt of them is still alive
+    # Return completed chunks whose output is lost
     def reset_chunk_from_worker(self, worker):
+        lost = []
         for chunk in self.chunks:
-            if worker == chunk.mapper:
-                chunk.status = MapStatus.accepted
+            if worker in chunk.attempts:
+                chunk.attempts.remove(worker)
+                if len(chunk.attempts) == 0 and not chunk.done:
+                    self.reset_chunk(chunk)
+            if chunk.done and worker == chunk.mapper:
+                self.reset_chunk(chunk)
+                lost.append(chunk)
+        return lost
+
+    # the first attempt which completes the chunk wins
+    # Return False if the chunk has been already completed by another attempt
+    def complete_chunk_from_worker(self, chunk_path, worker):
+        chunk = self.get_chunk(chunk_path)
+        if worker in chunk.attempts:
+            chunk.attempts.remove(worker)
+        if chunk.status == MapStatus.map_applied:
+            return False
 
-    def complete_chunk_from_worker(self, chunk_path):
-        for chunk in self.chunks:
-            if chunk_path == chunk.path:
-                chunk.status = MapStatus.map_applied
+        # attempt may be started by JT before restart, then the chunk is pending
+        self.take_chunk(chunk)
+        chunk.status = MapStatus.map_applied
+        chunk.mapper = worker
+        if chunk.started is not None:
+            self.map_durations.append(time.time() - chunk.started)
+        return True
 
     def get_chunk_to_process(self):
-        for chunk in self.chunks:
-            if chunk.status == MapStatus.accepted:
-                return chunk
+        return next(iter(self.pending.values()), None)
+
+    def create_regions(self):
+        for r in range(self.rds_count):
+            self.regions[r+1] = Region(r+1)
+
+    def reset_regions_from_worker(self, worker):
+        for region in self.regions.values():
+            if worker in region.attempts and region.status != ReduceStatus.finished:
+                region.attempts.remove(worker)
+                if len(region.attempts) == 0:
+                    region.reset()
+
+    # result_path - DFS path of the result saved by the attempt
+    # Return False if the region has been already completed by another attempt
+    def complete_region_from_worker(self, number, worker, result_path):
+        region = self.regions[number]
+        if worker in region.attempts:
+            region.attempts.remove(worker)
+        if region.done:
+            return False
+
+        region.status = ReduceStatus.finished
+        region.reducer = worker
+        region.result_path = result_path
+        if region.started is not None:
+            self.reduce_durations.append(time.time() - region.started)
+        return True
+
+    def get_region_to_process(self):
+        for region in self.regions.values():
+            if region.status == ReduceStatus.accepted:
+                return region
 
         return None
 
+    # mappers with completed chunks whose output they hold
+    # Return list of [mapper_addr, list of chunk paths]
     def mappers(self):
-        mps = set()
+        mps = {}
         for chunk in self.chunks:
-            mps.add(chunk.mapper)
+            if chunk.done:
+                mps.setdefault(chunk.mapper, []).append(chunk.path)
+
+        return [[addr, paths] for addr, paths in mps.items()]
+
 
-        return list(mps)
+# worker as it is seen by JT from its heartbeats
+class WorkerInfo:
+    def __init__(self, addr):
+        self.addr = addr
+        self.host = host_of(addr)
+        self.last_heartbeat = datetime.now()
+        self.free_map_slots = 0
+        self.free_reduce_slots = 0
+        self.running = {}  # (kind, task_id, chunk path or region number) -> chunk or region assigned to the worker
 
 
 class JobTracker:
-    def __init__(self, dump_on=True):
-        self.dfs = Client()
+    # dfs - client of DFS, yadfs client if None
+    def __init__(self, dump_on=True, dfs=None):
+        if dfs is None:
+            from yadfs.client.client import Client
+            dfs = Client()
+        self.dfs = dfs
         self.dump_on = dump_on
-        self.dump_path = "./job_tracker.yml"
-        self.workers = {}
+        self.dump_path = "./job_tracker.journal"  # append-only journal of changes of tasks, see _journal
+        self.journal = None
+        self.journal_records = 0  # records appended since the journal was compacted
+        self.compact_records = 10000  # journal is compacted when so many records are appended
+        self.finished_ttl = 600  # seconds finished tasks are kept for clients before they are removed
+        self.workers = {}  # address -> WorkerInfo
+        self.worker_hosts = Counter()  # number of alive workers on every host
         self.tasks = {}
+        self.running = Counter()  # number of running attempts of every task
         self.worker_timeout = 2
-        self.free_workers = []
-        self.workers_tasks = {}
-        self.current_task = ""
-        self.regions = {}
-        self.lock = threading.Lock()
+        self.max_running_tasks = 4  # tasks above the limit wait in the admission queue
+        self.queue = []  # heap of (-priority, sequence number, task_id) of queued tasks
+        self.queue_seq = itertools.count()
+        # guards state of tasks and workers, notified on every change of it
+        self.lock = threading.Condition()
+        self.sample_chunks = 10  # number of chunks sampled for total order partitioning
+        self.sample_size = 1000  # number of keys sampled from one chunk
+        self.locality_delay = 0.5  # seconds a chunk waits for a worker on its host before going to any worker
+        self.speculative = True  # launch backup attempts of straggling chunks and regions
+        self.speculative_progress = 0.75  # fraction of completed items before backups are launched
+        self.speculative_slowdown = 2.0  # item is a straggler if it runs longer than median time multiplied by it
+        self.speculative_min_time = 1.0  # items running less seconds are never speculated
+        self.max_failures = 4  # task fails when one of its chunks or regions failed so many times
+        # fraction of mapped chunks after which reducers start and fetch outputs of maps as they complete
+        self.reduce_slowstart = 0.8
 
     # start job tracker
     def start(self):
         self._load_dump()
         _thread.start_new_thread(self.worker_watcher, ())
 
+    # restore tasks from the journal and continue them, map outputs of completed chunks are reused
+    # if their workers are alive, finished tasks are dropped and the journal is compacted
     def _load_dump(self):
-        pass
+        if not self.dump_on:
+            return
+
+        with self.lock:
+            if os.path.isfile(self.dump_path):
+                with open(self.dump_path) as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            break  # the last record may be written partially before the crash
+                        self._replay(record)
+                self._recover_tasks()
+            for task_id in [task_id for task_id, task in self.tasks.items() if task.status in TaskStatus.ended]:
+                del self.tasks[task_id]
+            self._compact()
+
+    # replace the journal with records of the current state of unfinished tasks, called under lock
+    def _compact(self):
+        tmp_path = self.dump_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            for task_id, task in self.tasks.items():
+                if task.status not in TaskStatus.ended:
+                    for record in self._task_records(task_id, task):
+                        f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.dump_path)
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.dump_path, 'a')
+        self.journal_records = 0
+
+    # append the record of a change of a task to the journal, called under lock
+    # the record is on disk when the call returns, so the change survives a crash of the host
+    # records: {op: task, task_id, input, script, chunks, rds_count, total_order, priority, input_format, codec},
+    # {op: status, task_id, status}, {op: split_points, task_id, split_points},
+    # {op: map, task_id, chunk, mapper}, {op: map_lost, task_id, chunk},
+    # {op: reduce, task_id, region, reducer, result_path}
+    def _journal(self, record):
+        if self.journal is not None:
+            self.journal.write(json.dumps(record) + "\n")
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.journal_records += 1
+
+    def _journal_status(self, task_id):
+        self._journal({'op': 'status', 'task_id': task_id, 'status': self.tasks[task_id].status})
+
+    # records which restore current state of the task
+    def _task_records(self, task_id, task):
+        records = [{'op': 'task', 'task_id': task_id, 'input': task.input, 'script': task.script,
+                    'chunks': {chunk.path: sorted(chunk.hosts) for chunk in task.chunks},
+                    'rds_count': task.rds_count, 'total_order': task.total_order, 'priority': task.weight,
+                    'input_format': task.input_format, 'codec': task.codec},
+                   {'op': 'status', 'task_id': task_id, 'status': task.status}]
+        if task.split_points is not None:
+            records.append({'op': 'split_points', 'task_id': task_id, 'split_points': task.split_points})
+        if task.status in TaskStatus.running:
+            records += [{'op': 'map', 'task_id': task_id, 'chunk': chunk.path, 'mapper': chunk.mapper}
+                        for chunk in task.chunks if chunk.done]
+        records += [{'op': 'reduce', 'task_id': task_id, 'region': region.number, 'reducer': region.reducer,
+                     'result_path': region.result_path} for region in task.regions.values() if region.done]
+        return records
+
+    def _replay(self, record):
+        task_id = record['task_id']
+        if record['op'] == 'task':
+            self.tasks[task_id] = Task(record['input'], record['script'], record['chunks'], record['rds_count'],
+                                       record['total_order'], record['priority'], record.get('input_format'),
+                                       record.get('codec'))
+            return
 
-    # get heartbeat from worker
-    def heartbeat(self, worker_addr):
-        if worker_addr not in self.workers:
-            print('register worker ' + worker_addr)
+        task = self.tasks[task_id]
+        if record['op'] == 'status':
+            task.status = record['status']
+        elif record['op'] == 'split_points':
+            task.split_points = record['split_points']
+        elif record['op'] == 'map':
+            chunk = task.get_chunk(record['chunk'])
+            task.take_chunk(chunk)
+            chunk.status = MapStatus.map_applied
+            chunk.mapper = record['mapper']
+        elif record['op'] == 'map_lost':
+            task.reset_chunk(task.get_chunk(record['chunk']))
+        elif record['op'] == 'reduce':
+            if len(task.regions) == 0:
+                task.create_regions()
+            region = task.regions[record['region']]
+            region.status = ReduceStatus.finished
+            region.reducer = record['reducer']
+            region.result_path = record['result_path']
+
+    # continue tasks restored from the journal, attempts running before restart are dispatched again,
+    # workers which hold map outputs are expected to send heartbeats within worker_timeout,
+    # otherwise their chunks are reset by worker_watcher
+    def _recover_tasks(self):
+        for task_id, task in self.tasks.items():
+            if task.status in (TaskStatus.accepted, TaskStatus.queued):
+                task.status = TaskStatus.queued
+                heapq.heappush(self.queue, (-task.weight, next(self.queue_seq), task_id))
+            elif task.status == TaskStatus.sampling:
+                _thread.start_new_thread(self._sample_split_points, (task_id,))
+            elif task.status in (TaskStatus.mapping, TaskStatus.mapping_done, TaskStatus.reducing):
+                mapped = self._mapped_chunks(task)
+                if task.status == TaskStatus.mapping and mapped < len(task.chunks):
+                    task.start_mapping()
+                else:
+                    task.status = TaskStatus.reducing
+                if len(task.regions) == 0 and mapped >= self.reduce_slowstart * len(task.chunks):
+                    task.create_regions()
+                if task.status == TaskStatus.reducing and all(region.done for region in task.regions.values()):
+                    task.status = TaskStatus.task_done
+
+            if task.status in TaskStatus.running:
+                for chunk in task.chunks:
+                    if chunk.done and chunk.mapper not in self.workers:
+                        worker = WorkerInfo(chunk.mapper)
+                        self.workers[chunk.mapper] = worker
+                        self.worker_hosts[worker.host] += 1
+            print("Task: " + task_id + " is recovered with status " + str(task.status))
+
+        self._admit_queued()
 
-        self.workers[worker_addr] = datetime.now()
-        self.free_workers.append(worker_addr)
-        return {'status': Status.ok}
+    # get heartbeat from worker
+    # slots - dict {map: number of free map slots, reduce: number of free reduce slots}
+    # progress - list of dicts {kind: map or reduce, task_id, item: chunk path or region, status}
+    # of tasks running on the worker
+    # Return dict {status: Status.ok, assignments: list of new tasks for free slots of the worker,
+    # map_outputs: completed maps for reducers of the worker}, see _assignment and _map_outputs for formats
+    def heartbeat(self, worker_addr, slots=None, progress=None):
+        with self.lock:
+            worker = self.workers.get(worker_addr)
+            if worker is None:
+                print('register worker ' + worker_addr)
+                worker = WorkerInfo(worker_addr)
+                self.workers[worker_addr] = worker
+                self.worker_hosts[worker.host] += 1
+
+            worker.last_heartbeat = datetime.now()
+            if slots is not None:
+                worker.free_map_slots = slots['map']
+                worker.free_reduce_slots = slots['reduce']
+            if progress is not None:
+                self._check_progress(worker, progress)
+
+            assignments = self._schedule(worker)
+            if len(assignments) > 0:
+                self.lock.notify_all()
+            return {'status': Status.ok, 'assignments': [self._assignment(*a) for a in assignments],
+                    'map_outputs': self._map_outputs(progress or [])}
+
+    # attempts which JT assigned to the worker but the worker does not run are lost,
+    # e.g. the worker has not got the heartbeat response or restarted
+    def _check_progress(self, worker, progress):
+        reported = set((p['kind'], p['task_id'], str(p['item'])) for p in progress)
+        for key, item in list(worker.running.items()):
+            if key not in reported:
+                kind, task_id, label = key
+                print("Task: " + task_id + " " + kind + " of " + label + " is lost by " + worker.addr)
+                self._fail_attempt(task_id, kind, item, worker.addr)
+
+    # reducers which are still loading data get all completed maps of their tasks,
+    # so reducers started before the end of mapping fetch map outputs as they are completed
+    # Return list of dicts {task_id, mappers: list of [mapper_addr, list of chunk paths], maps_done}
+    def _map_outputs(self, progress):
+        task_ids = set(p['task_id'] for p in progress if p['kind'] == "reduce"
+                       and p['status'] in (ReduceStatus.accepted, ReduceStatus.start_data_loading))
+        outputs = []
+        for task_id in task_ids:
+            task = self.tasks.get(task_id)
+            if task is not None and task.status in (TaskStatus.mapping, TaskStatus.reducing):
+                outputs.append({'task_id': task_id, 'mappers': task.mappers(),
+                                'maps_done': task.status == TaskStatus.reducing})
+        return outputs
+
+    def _start_attempt(self, worker, kind, task_id, item):
+        worker.running[(kind, task_id, item.label)] = item
+        self.running[task_id] += 1
+        item.attempts.append(worker.addr)
+
+    # attempt is not running on the worker anymore
+    def _end_attempt(self, worker_addr, kind, task_id, label):
+        worker = self.workers.get(worker_addr)
+        if worker is not None and worker.running.pop((kind, task_id, label), None) is not None:
+            self.running[task_id] -= 1
+
+    # attempt of the worker failed, the item is dispatched again
+    # unless another attempt is alive or it failed max_failures times
+    def _fail_attempt(self, task_id, kind, item, worker_addr):
+        self._end_attempt(worker_addr, kind, task_id, item.label)
+        if worker_addr not in item.attempts:
+            return
+
+        item.attempts.remove(worker_addr)
+        if item.done or len(item.attempts) > 0:
+            return
+
+        item.failures += 1
+        if item.failures >= self.max_failures:
+            print("Task: " + task_id + " failed, " + item.label + " failed " + str(item.failures) + " times")
+            self._finish_task(task_id, TaskStatus.failed)
+        elif kind == "map":
+            self.tasks[task_id].reset_chunk(item)
+        else:
+            item.reset()
 
     def _is_alive_worker(self, w_addr):
         if w_addr not in self.workers:
             return False
 
-        last_hb = self.workers[w_addr]
+        last_hb = self.workers[w_addr].last_heartbeat
         now = datetime.now()
         diff = (now - last_hb).total_seconds()
         return diff <= self.worker_timeout
 
     def worker_watcher(self):
         while 1:
-            for w_name in list(self.workers):
-                if not self._is_alive_worker(w_name):
-                    print('Worker ', w_name, ' detected as not alive')
-                    self.workers.pop(w_name)
-                    if self.workers_tasks[w_name] == "map":
-                        task = self.tasks[self.current_task]
-                        task.reset_chunk_from_worker(w_name)
-
+            with self.lock:
+                self._remove_dead_workers()
+                self._expire_finished_tasks()
+                if self.journal is not None and self.journal_records >= self.compact_records:
+                    self._compact()
             time.sleep(self.worker_timeout)
 
-    def create_task(self, input, script):
+    # attempts of dead workers are reset and chunks whose output they hold are mapped again,
+    # reducing tasks go back to mapping as their unfinished regions need the lost outputs, called under lock
+    def _remove_dead_workers(self):
+        for w_name in list(self.workers):
+            if self._is_alive_worker(w_name):
+                continue
+
+            print('Worker ', w_name, ' detected as not alive')
+            worker = self.workers.pop(w_name)
+            self.worker_hosts[worker.host] -= 1
+            if self.worker_hosts[worker.host] == 0:
+                del self.worker_hosts[worker.host]
+            for kind, task_id, _ in worker.running:
+                self.running[task_id] -= 1
+
+            for task_id, task in self.tasks.items():
+                if task.status not in (TaskStatus.mapping, TaskStatus.reducing):
+                    continue
+
+                task.reset_regions_from_worker(w_name)
+                lost = task.reset_chunk_from_worker(w_name)
+                for chunk in lost:
+                    self._journal({'op': 'map_lost', 'task_id': task_id, 'chunk': chunk.path})
+                if len(lost) > 0 and task.status == TaskStatus.reducing:
+                    print("Task: " + task_id + " lost " + str(len(lost)) + " map outputs, start mapping again")
+                    task.start_mapping()
+                    self._journal_status(task_id)
+            self.lock.notify_all()
+
+    # input - DFS path to input data
+    # script - DFS path to the map reduce script
+    # total_order - if True then results of the task are sorted globally
+    # priority - weight of the task in fair share of workers and in the admission queue
+    # input_format - name of input format which splits chunks into records, see input_format.get_input_format
+    # codec - spec of codec of map outputs, shuffle and results, see serialization.get_codec
+    # empty input_format or codec means None, so that clients without allow_none can skip them
+    # task is queued if max_running_tasks tasks are already running
+    def create_task(self, input, script, total_order=False, priority=1, input_format=None, codec=None):
+        input_format = input_format or None
+        codec = codec or None
+        if input_format is not None:
+            get_input_format(input_format)  # raises ValueError for unknown format
+        get_codec(codec)
         input_info = self.dfs.path_status(input)
         task_id = str(uuid.uuid4())
-        self.current_task = task_id
-        task = Task(input, script, input_info['chunks'], len(self.workers))
-        self.tasks[task_id] = task
 
-        task.status = TaskStatus.mapping
-
-        print("Task: " + task_id + " start mapping")
-        _thread.start_new_thread(self._handle_map, (task_id,))
+        with self.lock:
+            task = Task(input, script, input_info['chunks'], len(self.workers), total_order, priority, input_format,
+                        codec)
+            self.tasks[task_id] = task
+            self._journal(self._task_records(task_id, task)[0])
+
+            if self._running_tasks() < self.max_running_tasks:
+                self._admit(task_id)
+            else:
+                task.status = TaskStatus.queued
+                heapq.heappush(self.queue, (-task.weight, next(self.queue_seq), task_id))
+                self._journal_status(task_id)
+                print("Task: " + task_id + " is queued, tasks in queue: " + str(len(self.queue)))
+            self.lock.notify_all()
 
         return task_id
 
-    def get_free_worker(self):
-        if len(self.free_workers) == 0:
-            return None
-        worker = self.free_workers[0]
-        self.free_workers.remove(worker)
-        return worker
+    def _running_tasks(self):
+        return sum(1 for task in self.tasks.values() if task.status in TaskStatus.running)
 
-    def _handle_map(self, task_id):
+    # start queued task, called under lock
+    def _admit(self, task_id):
         task = self.tasks[task_id]
-        status = task.status
+        if task.total_order and task.rds_count > 1:
+            task.status = TaskStatus.sampling
+            _thread.start_new_thread(self._sample_split_points, (task_id,))
+        else:
+            task.start_mapping()
+            print("Task: " + task_id + " start mapping")
+        self._journal_status(task_id)
+
+    # task is done or failed, its place is taken by a queued task with the highest priority
+    # finished tasks are removed finished_ttl seconds after their end, called under lock
+    def _expire_finished_tasks(self):
+        now = time.time()
+        for task_id, task in list(self.tasks.items()):
+            if task.finished is None or now - task.finished < self.finished_ttl:
+                continue
+
+            print("Task: " + task_id + " is removed after its end")
+            del self.tasks[task_id]
+            self.running.pop(task_id, None)
+            for worker in self.workers.values():
+                for key in [key for key in worker.running if key[1] == task_id]:
+                    del worker.running[key]
+
+    def _finish_task(self, task_id, status):
+        self.tasks[task_id].status = status
+        self.tasks[task_id].finished = time.time()
+        self._journal_status(task_id)
+        self._admit_queued()
+
+    def _admit_queued(self):
+        while len(self.queue) > 0 and self._running_tasks() < self.max_running_tasks:
+            _, _, queued_id = heapq.heappop(self.queue)
+            self._admit(queued_id)
+
+    # sample keys from a subset of chunks and compute split points of regions,
+    # task falls back to hash partitioning if sampling fails
+    def _sample_split_points(self, task_id):
+        with self.lock:
+            task = self.tasks[task_id]
+            workers = list(self.workers.keys())
+        print("Task: " + task_id + " start sampling")
+
+        chunks = random.sample(task.chunks, min(self.sample_chunks, len(task.chunks)))
+
+        def sample(i):
+            worker_addr = workers[i % len(workers)]
+            args = (task_id, chunks[i].path, task.script, self.sample_size)
+            if task.input_format is not None:
+                args += (task.input_format,)
+            r = ServerProxy(worker_addr).sample(*args)
+            if r['status'] != Status.ok:
+                raise Exception("worker " + worker_addr + " failed to sample chunk " + chunks[i].path)
+            return r['keys']
+
+        try:
+            if len(workers) == 0:
+                raise Exception("no workers to sample chunks")
+
+            keys = []
+            with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+                for r in executor.map(sample, range(len(chunks))):
+                    keys.extend(r)
+            split_points = compute_split_points(keys, task.rds_count)
+        except Exception as e:
+            print("Task: " + task_id + " failed to sample keys, fall back to hash partitioning:", e)
+            split_points = None
+
+        with self.lock:
+            task.split_points = split_points
+            task.start_mapping()
+            if split_points is not None:
+                self._journal({'op': 'split_points', 'task_id': task_id, 'split_points': split_points})
+            self._journal_status(task_id)
+            print("Task: " + task_id + " split points: " + str(task.split_points))
+            self.lock.notify_all()
+
+    # pick work for free slots of the worker, called under lock
+    # every slot goes to the running task with the lowest number of running attempts
+    # relative to its weight, so small jobs are not starved by large ones,
+    # slots left free are used for backup attempts of stragglers
+    # Return list of (kind, task_id, chunk or region)
+    def _schedule(self, worker):
+        assignments = []
+        now = time.time()
+        active = [(task_id, task) for task_id, task in self.tasks.items()
+                  if task.status == TaskStatus.mapping or task.status == TaskStatus.reducing]
+
+        for kind, free in (("map", worker.free_map_slots), ("reduce", worker.free_reduce_slots)):
+            for _ in range(free):
+                a = None
+                for task_id, task in sorted(active, key=lambda a: (self.running[a[0]] / a[1].weight, -a[1].weight)):
+                    a = self._pick_work(kind, task_id, task, worker, now) or self._speculate(kind, task_id, task, worker, now)
+                    if a is not None:
+                        break
+                if a is None:
+                    break
+                assignments.append(a)
+
+        return assignments
+
+    # chunk or region of the task for the worker
+    # Return (kind, task_id, chunk or region) or None if the task has no work of the kind for the worker
+    def _pick_work(self, kind, task_id, task, worker, now):
+        if kind == "map" and task.status == TaskStatus.mapping:
+            chunk, local = self._pick_chunk(task, worker, now)
+            if chunk is None:
+                return None
+
+            task.take_chunk(chunk)
+            self._start_attempt(worker, kind, task_id, chunk)
+            chunk.mapper = worker.addr
+            chunk.status = MapStatus.chunk_loaded
+            chunk.started = now
+            if local:
+                task.local_maps += 1
+            else:
+                task.remote_maps += 1
+            return kind, task_id, chunk
+
+        # regions exist since slow-start of reducers
+        if kind == "reduce" and len(task.regions) > 0:
+            region = task.get_region_to_process()
+            if region is None:
+                return None
+
+            self._start_attempt(worker, kind, task_id, region)
+            region.reducer = worker.addr
+            region.status = ReduceStatus.start_data_loading
+            region.started = now
+            return kind, task_id, region
+
+        return None
+
+    # backup attempt of a straggler of the task for the worker, stragglers are looked for
+    # when all items of the phase are dispatched and most of them are completed
+    # Return (kind, task_id, chunk or region) or None if there is no straggler
+    def _speculate(self, kind, task_id, task, worker, now):
+        if not self.speculative:
+            return None
+        if kind == "map" and task.status == TaskStatus.mapping and task.get_chunk_to_process() is None:
+            items, durations = task.chunks, task.map_durations
+        elif kind == "reduce" and task.status == TaskStatus.reducing and task.get_region_to_process() is None:
+            items, durations = list(task.regions.values()), task.reduce_durations
+        else:
+            return None
 
-        while status != TaskStatus.mapping_done:
-            chunk = task.get_chunk_to_process()
+        # every completed item adds its duration
+        if len(durations) == 0 or len(durations) < self.speculative_progress * len(items):
+            return None
 
-            if chunk is not None:
-                worker_addr = self.get_free_worker()
-                if worker_addr is not None:
-                    self.workers_tasks[worker_addr] = "map"
+        limit = max(self.speculative_min_time, self.speculative_slowdown * statistics.median(durations))
+        for item in items:
+            if item.done or len(item.attempts) != 1 or worker.addr in item.attempts or now - item.started < limit:
+                continue
 
-                    worker = ServerProxy(worker_addr)
-                    worker.map(task_id, task.rds_count, chunk.path, task.script)
-                    chunk.mapper = worker_addr
-                    chunk.status = MapStatus.chunk_loaded
+            self._start_attempt(worker, kind, task_id, item)
+            print("Task: " + task_id + " launch backup " + kind + " of " + item.label + " on " + worker.addr)
+            return kind, task_id, item
+
+        return None
 
-            status = task.status
-            time.sleep(0.1)
+    # chunk for the worker: a chunk stored on the host of the worker if there is one,
+    # otherwise a chunk which waited for a local worker longer than locality_delay
+    # or which has no alive workers on its hosts
+    # Return chunk and True if it is local for the worker
+    def _pick_chunk(self, task, worker, now):
+        local = task.pending_by_host.get(worker.host)
+        if local:
+            return next(iter(local.values())), True
+
+        # pending chunks are ordered by pending_since, so the longest waiting one is checked first
+        for chunk in task.pending.values():
+            if now - chunk.pending_since >= self.locality_delay or chunk.hosts.isdisjoint(self.worker_hosts):
+                return chunk, False
+
+        return None, False
+
+    # task for the worker in heartbeat response
+    # Return dict {kind: map, task_id, rds_count, chunk_path, script, split_points (if set)}
+    # or {kind: reduce, task_id, region, mappers, script, maps_done},
+    # reducer waits for the rest of map outputs in heartbeat responses unless maps_done
+    def _assignment(self, kind, task_id, item):
+        task = self.tasks[task_id]
+        if kind == "reduce":
+            a = {'kind': kind, 'task_id': task_id, 'region': item.number, 'mappers': task.mappers(),
+                 'script': task.script, 'maps_done': task.status == TaskStatus.reducing}
+            if task.codec is not None:
+                a['codec'] = task.codec
+            return a
+
+        a = {'kind': kind, 'task_id': task_id, 'rds_count': task.rds_count, 'chunk_path': item.path,
+             'script': task.script}
+        if task.split_points is not None:
+            a['split_points'] = task.split_points
+        if task.input_format is not None:
+            a['input_format'] = task.input_format
+        if task.codec is not None:
+            a['codec'] = task.codec
+        return a
 
     # RPC call from mapped when a task is done:
     # mapper_addr: address of a mapper
     # task_id: id of task completed map
     # chunk_path: path of a chunk being mapped
-    def mapping_done(self, mapper_addr, task_id, chunk_path):
-        self.lock.acquire()
-        try:
+    # stats: {raw, stored} sizes of map output if the task has codec, may be empty
+    # metrics: counters and timings of the map, see metrics.Metrics.to_dict
+    def mapping_done(self, mapper_addr, task_id, chunk_path, stats=None, metrics=None):
+        with self.lock:
             if task_id not in self.tasks:
                 return {"status": Status.not_found}
 
-            print("Task: " + task_id + " completed map for chunk: " + chunk_path)
-
             task = self.tasks[task_id]
-            task.complete_chunk_from_worker(chunk_path)
+            if task.complete_chunk_from_worker(chunk_path, mapper_addr):
+                self._journal({'op': 'map', 'task_id': task_id, 'chunk': chunk_path, 'mapper': mapper_addr})
+                self._add_bytes(task, "map", stats)
+                self._add_metrics(task, "map", metrics)
+                print("Task: " + task_id + " completed map for chunk: " + chunk_path)
+            else:
+                print("Task: " + task_id + " ignore map of " + mapper_addr + " for completed chunk: " + chunk_path)
+
+            mapped = self._mapped_chunks(task)
+
+            self._end_attempt(mapper_addr, "map", task_id, chunk_path)
+
+            if task.status == TaskStatus.mapping and len(task.regions) == 0 \
+                    and mapped >= self.reduce_slowstart * len(task.chunks):
+                task.create_regions()
+                print("Task: " + task_id + " start reducers, mapped " + str(mapped) + " of "
+                      + str(len(task.chunks)) + " chunks")
+
+            if mapped == len(task.chunks) and task.status == TaskStatus.mapping:
+                print("Task: " + task_id + " map completed, local maps: " + str(task.local_maps)
+                      + ", remote maps: " + str(task.remote_maps))
+                task.status = TaskStatus.mapping_done
+                # reducers which waited for maps are timed from now, so they are not taken for stragglers
+                now = time.time()
+                for region in task.regions.values():
+                    if region.started is not None:
+                        region.started = max(region.started, now)
+                task.status = TaskStatus.reducing
+                self._journal_status(task_id)
+                print("Task: " + task_id + " start reducing")
 
-            map_completed = self._check_task_status(task_id)
+            self.lock.notify_all()
+            return {"status": Status.ok}
 
-            self.free_workers.append(mapper_addr)
+    # RPC call from mapper when map of the chunk failed
+    def mapping_failed(self, mapper_addr, task_id, chunk_path):
+        with self.lock:
+            if task_id not in self.tasks:
+                return {"status": Status.not_found}
 
-            if map_completed:
-                print("Task: " + task_id + " map completed")
-                task.status = TaskStatus.mapping_done
-                _thread.start_new_thread(self._handle_reduce, (task_id,))
-                print("Task: " + task_id + " start reducing")
-        finally:
-            self.lock.release()
+            print("Task: " + task_id + " map of " + mapper_addr + " failed for chunk: " + chunk_path)
+            self._fail_attempt(task_id, "map", self.tasks[task_id].get_chunk(chunk_path), mapper_addr)
+            self.lock.notify_all()
+            return {"status": Status.ok}
 
-    def _handle_reduce(self, task_id):
-        task = self.tasks[task_id]
-        wn = 0
-        workers = list(self.workers.keys())
-        for r in range(task.rds_count):
-            self.regions[r+1] = workers[wn]
-            wn += 1
-            if wn == len(workers):
-                wn = 0
-
-        status = task.status
-
-        while status != TaskStatus.task_done:
-            for region, worker_addr in self.regions.copy().items():
-                if worker_addr in self.free_workers:
-                    self.free_workers.remove(worker_addr)
-                    self.workers_tasks[worker_addr] = "reduce"
-                    worker = ServerProxy(worker_addr)
-                    worker.reduce(task_id, region, task.mappers(), task.script)
-                time.sleep(0.1)
-
-            status = task.status
+    # RPC call from reducer when reduce of the region failed
+    def reducing_failed(self, addr, task_id, region):
+        with self.lock:
+            if task_id not in self.tasks:
+                return {"status": Status.not_found}
+
+            print("Task: " + task_id + " reduce of " + addr + " failed for region: " + str(region))
+            self._fail_attempt(task_id, "reduce", self.tasks[task_id].regions[region], addr)
+            self.lock.notify_all()
+            return {"status": Status.ok}
 
     # RPC call from reducer that is done
     # addr - reducer addr
     # task_id - unique task_id
     # region - number of task which was completed
-    def reducing_done(self, addr, task_id, region):
-        self.lock.acquire()
-        try:
+    # result_path - DFS path of the result, attempts of one region save results to different paths
+    # stats - {raw, stored} sizes of the result if the task has codec, may be empty
+    # metrics - counters and timings of the reduce, see metrics.Metrics.to_dict
+    def reducing_done(self, addr, task_id, region, result_path=None, stats=None, metrics=None):
+        with self.lock:
             if task_id not in self.tasks:
                 return {"status": Status.not_found}
 
             task = self.tasks[task_id]
+            if result_path is None:
+                result_path = "/" + task_id + "/result/" + str(region)
+            if task.complete_region_from_worker(region, addr, result_path):
+                self._journal({'op': 'reduce', 'task_id': task_id, 'region': region, 'reducer': addr,
+                               'result_path': result_path})
+                self._add_bytes(task, "result", stats)
+                self._add_metrics(task, "reduce", metrics)
+            else:
+                print("Task: " + task_id + " ignore reduce of " + addr + " for completed region: " + str(region))
 
-            self.regions.pop(region)
-            print(self.regions)
-
-            self.free_workers.append(addr)
+            self._end_attempt(addr, "reduce", task_id, str(region))
 
-            reduce_done = len(self.regions) == 0
+            reduce_done = all(r.status == ReduceStatus.finished for r in task.regions.values())
 
-            if reduce_done:
-                self.current_task = ""
+            if reduce_done and task.status == TaskStatus.reducing:
                 print("Task: " + task_id + " complete reducing")
-                task.status = TaskStatus.task_done
-        finally:
-            self.lock.release()
+                self._finish_task(task_id, TaskStatus.task_done)
 
-    def _check_task_status(self, task_id):
-        task = self.tasks[task_id]
-        for chunk in task.chunks:
-            if chunk.status != MapStatus.map_applied:
-                return False
+            self.lock.notify_all()
+            return {"status": Status.ok}
 
-        return True
+    # stats - {raw, stored} sizes of compressed data sent by the worker whose attempt completed the item
+    @staticmethod
+    def _add_bytes(task, kind, stats):
+        if stats:
+            task.bytes[kind + "_raw"] += stats['raw']
+            task.bytes[kind + "_stored"] += stats['stored']
+
+    # metrics of backup attempts whose item was already completed are not added, so counters are not doubled
+    @staticmethod
+    def _add_metrics(task, kind, metrics):
+        task.metrics[kind].add(kind + "s")
+        if metrics:
+            task.metrics[kind].update(metrics)
+
+    def _mapped_chunks(self, task):
+        return sum(1 for chunk in task.chunks if chunk.done)
+
+    # RPCs about a task return {status: Status.not_found} if the task is unknown
 
     def get_status(self, task_id):
+        if task_id not in self.tasks:
+            return {'status': Status.not_found}
         task = self.tasks[task_id]
         return task.status
 
+    # block until status of the task differs from the given one or timeout in seconds expires
+    # Return current status of the task
+    def wait_status(self, task_id, status, timeout=10):
+        with self.lock:
+            if task_id not in self.tasks:
+                return {'status': Status.not_found}
+            task = self.tasks[task_id]
+            self.lock.wait_for(lambda: task.status != status, timeout)
+            return task.status
+
+    # number of chunks mapped on hosts of their chunk servers and on other hosts
+    def get_locality(self, task_id):
+        if task_id not in self.tasks:
+            return {'status': Status.not_found}
+        task = self.tasks[task_id]
+        return {'local': task.local_maps, 'remote': task.remote_maps}
+
+    # sizes of compressed map outputs and results of the task, map outputs are shuffled as they are stored
+    # sizes are floats as they may exceed int of XML-RPC
+    # Return dict {codec, map_raw, map_stored, result_raw, result_stored, saved: bytes saved in total}
+    def get_compression(self, task_id):
+        with self.lock:
+            if task_id not in self.tasks:
+                return {'status': Status.not_found}
+            task = self.tasks[task_id]
+            r = {k: float(task.bytes[k]) for k in ("map_raw", "map_stored", "result_raw", "result_stored")}
+            r['saved'] = r['map_raw'] - r['map_stored'] + r['result_raw'] - r['result_stored']
+            r['codec'] = task.codec or ""
+            return r
+
+    # counters and timings of the task summed over completed maps and reduces
+    # values are floats as they may exceed int of XML-RPC
+    # Return dict {status, counters: name -> value, timings: {map, reduce} of phase -> seconds,
+    # user: counters incremented by the script, elapsed: seconds from creation to the end or to now}
+    def get_metrics(self, task_id):
+        with self.lock:
+            if task_id not in self.tasks:
+                return {'status': Status.not_found}
+
+            task = self.tasks[task_id]
+            counters = Counter()
+            user = Counter()
+            for m in task.metrics.values():
+                counters.update(m.counters)
+                user.update(m.user)
+            end = task.finished if task.finished is not None else time.time()
+            return {'status': Status.ok,
+                    'counters': {k: float(v) for k, v in counters.items()},
+                    'timings': {kind: {k: float(v) for k, v in m.timings.items()} for kind, m in task.metrics.items()},
+                    'user': {k: float(v) for k, v in user.items()},
+                    'elapsed': end - task.created}
+
+    # DFS paths of results of regions in order of their numbers
     def get_result(self, task_id):
+        if task_id not in self.tasks:
+            return {'status': Status.not_found}
         task = self.tasks[task_id]
         results = []
         for i in range(task.rds_count):
-            path = "/" + task_id + "/result/" + str(i+1)
-            results.append(path)
+            region = task.regions.get(i+1)
+            results.append(region.result_path if region is not None else "")
 
         return results
 
+    # block until more than known regions are reduced or the task is finished
+    # Return dict {status: status of the task, result: DFS paths of results, "" for regions being reduced}
+    def wait_result(self, task_id, known, timeout=10):
+        with self.lock:
+            if task_id not in self.tasks:
+                return {'status': Status.not_found}
+            task = self.tasks[task_id]
+            self.lock.wait_for(lambda: task.status in (TaskStatus.task_done, TaskStatus.failed) or
+                               sum(1 for region in task.regions.values() if region.done) > known, timeout)
+            return {'status': task.status, 'result': self.get_result(task_id)}
+
+
+# xml-rpc server which handles every request in its own thread,
+# so blocking calls like wait_status do not stop heartbeats
+class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
 
-# args: host and port: localhost 11111
+# args: path to config, optional, selects file system with "fs" option
 if __name__ == '__main__':
     # if len(sys.argv) == 3:
     #     host = sys.argv[1]
@@ -267,10 +1010,11 @@ if __name__ == '__main__':
     
     host = socket.gethostbyname(socket.gethostname())
     port = 11111
-    jt = JobTracker(dump_on=True)
+    opts = cfg.load(sys.argv[1]) if len(sys.argv) > 1 else {}
+    jt = JobTracker(dump_on=True, dfs=cfg.create_fs(opts))
     jt.start()
 
-    server = SimpleXMLRPCServer((host, port), logRequests=False, allow_none=True)
+    server = ThreadedXMLRPCServer((host, port), logRequests=False, allow_none=True)
     server.register_introspection_functions()
     server.register_instance(jt)
     server.serve_forever()
@@ -0,0 +1,90 @@
+import multiprocessing
+import os
+import tempfile
+
+from enums import MapStatus, ReduceStatus, Status
+from fake_fs import FakeFS
+from hash_partitioner import HashPartitioner
+from metrics import Metrics
+from mapper import MapTask, execute_map
+from reducer import ReduceTask, execute_reduce
+from script_cache import LocalScript
+from serialization import BinarySerializer
+
+
+# Runs a job on a single machine without JT, RPC and DFS.
+# Input files are split to chunks by lines, chunks are mapped in a pool of processes
+# with the same map and reduce code as workers use, map output stays on the local disk.
+# script - local path to the map reduce script
+# rds_count - number of regions (reducers)
+# processes - size of the process pool, map and reduce run in the current process if 1
+# chunk_size - approximate size of a chunk in characters
+class LocalRunner:
+    def __init__(self, script, rds_count=None, processes=None, chunk_size=1 << 18):
+        self.script = os.path.abspath(script)
+        self.processes = processes or os.cpu_count() or 1
+        self.rds_count = rds_count or self.processes
+        self.chunk_size = chunk_size
+        self.partitioner = HashPartitioner("crc32")
+        self.serializer = BinarySerializer()
+        self.metrics = Metrics()  # counters and timings of the last run summed over maps and reduces
+
+    # input - path to a file or a directory with input files
+    # Return list of reduced tuples, regions are concatenated in order of their numbers
+    def run(self, input):
+        self.metrics = Metrics()
+        with tempfile.TemporaryDirectory(prefix="yamr") as work_dir:
+            script = LocalScript.from_file(self.script)
+            map_args = []
+            for i, data in enumerate(self._chunks(input)):
+                task = MapTask("local", self.rds_count, "/" + str(i), self.script)
+                map_args.append((task, script, data, self.partitioner, self.serializer,
+                                 work_dir + "/spill/" + str(i), work_dir + "/map/" + str(i), 10000))
+
+            reduce_args = []
+            for region in range(1, self.rds_count + 1):
+                paths = [args[6] + "/" + str(region) for args in map_args]
+                reduce_args.append((ReduceTask("local", region, [], self.script), script, paths, self.serializer))
+
+            if self.processes == 1:
+                return self._execute(lambda fn, args: [fn(*a) for a in args], map_args, reduce_args)
+
+            with multiprocessing.Pool(self.processes) as pool:
+                return self._execute(pool.starmap, map_args, reduce_args)
+
+    def _execute(self, starmap, map_args, reduce_args):
+        for r in starmap(execute_map, map_args):
+            if r['status'] != MapStatus.partitions_saved:
+                raise Exception("map failed with status " + str(r['status']))
+            self.metrics.update(r['metrics'])
+
+        result = []
+        for r in starmap(execute_reduce, reduce_args):
+            if r['status'] != ReduceStatus.data_reduced:
+                raise Exception("reduce failed with status " + str(r['status']))
+            self.metrics.update(r['metrics'])
+            result.extend(r['result'])
+
+        return result
+
+    # read input files with FakeFS and split them to chunks on line boundaries
+    def _chunks(self, input):
+        if os.path.isdir(input):
+            fs = FakeFS(input)
+            names = sorted(os.listdir(input))
+        else:
+            fs = FakeFS(os.path.dirname(os.path.abspath(input)))
+            names = [os.path.basename(input)]
+
+        for name in names:
+            r = fs.get_chunk("/" + name)
+            if r['status'] != Status.ok:
+                continue
+
+            data = r['data']
+            start = 0
+            while start < len(data):
+                end = data.find("\n", start + self.chunk_size)
+                end = len(data) if end == -1 else end + 1
+                yield data[start:end]
+                start = end
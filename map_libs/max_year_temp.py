@@ -6,9 +6,12 @@ import json
 class Mapper:
     def __init__(self):
         self.tuples = None
+        self.collector = None
 
-    def run_map(self, data):
+    # collector - if given, emitted tuples are passed to it instead of the returned list
+    def run_map(self, data, collector=None):
         self.tuples = []
+        self.collector = collector
         self.map(data)
         return self.tuples
 
@@ -22,47 +25,11 @@ class Mapper:
             self.emit(year, t[1])
 
     def emit(self, key, value):
-        self.tuples.append((key, value))
+        if self.collector is not None:
+            self.collector.emit(key, value)
+        else:
+            self.tuples.append((key, value))
 
 
-class Reducer:
-    def __init__(self):
-        self.tuples = None
-
-    def run_reduce(self, data):
-        self.tuples = []
-        combined = self.combine_data(data)
-        for t in combined:
-            self.reduce(t[0], t[1])
-        return self.tuples
-
-    @staticmethod
-    def combine_data(data):
-        if len(data) == 0:
-            return {}
-
-        result = []
-
-        curr_key = data[0][0]
-        new_t = (curr_key, [])
-        result.append(new_t)
-
-        for t in sorted(data, key=lambda x: x[0]):
-            key = t[0]
-            val = t[1]
-
-            if curr_key != key:
-                curr_key = key
-                new_t = (curr_key, [])
-                result.append(new_t)
-
-            new_t[1].append(val)
-
-        return result
-
-    def reduce(self, key, values):
-        s = max(x for x in values)
-        self.emit(key, s)
-
-    def emit(self, key, value):
-        self.tuples.append((key, value))
+# maximum is computed by the framework with hash aggregation on map and reduce sides
+Aggregate = "max"
@@ -0,0 +1,22 @@
+import numpy as np
+
+# this task counts maximum temperature of a year with the batch contract over NumPy arrays
+# it requires input as lines "201604 32.5"
+
+
+class Mapper:
+    def map_batch(self, data):
+        rows = np.array(data.split(), dtype=np.float64).reshape(-1, 2)
+        years = rows[:, 0].astype(np.int64) // 100
+        return years, rows[:, 1]
+
+
+class Reducer:
+    # keys are sorted, so maximum of every year is computed over segments of equal keys
+    def reduce_batch(self, keys, values):
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        return keys[starts], np.maximum.reduceat(values, starts)
+
+
+# max is associative, so reducer can be applied on the map side too
+Combiner = Reducer
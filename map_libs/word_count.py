@@ -3,24 +3,32 @@ import re
 class Mapper:
     def __init__(self):
         self.tuples = None
+        self.collector = None
 
-    def run_map(self, data):
+    # collector - if given, emitted tuples are passed to it instead of the returned list
+    def run_map(self, data, collector=None):
         self.tuples = []
+        self.collector = collector
         self.map(data)
         return self.tuples
 
+    # data - whole chunk or iterator of lines if the task has input format
     def map(self, data):
         if data is None:
             return
 
-        for word in re.compile(r'\w+').findall(data):
-            word = word.strip(',.').lower()
-            # exclude empty strings from keys
-            if len(word) > 0:
-                self.emit(word, 1)
+        for text in ([data] if isinstance(data, str) else data):
+            for word in re.compile(r'\w+').findall(text):
+                word = word.strip(',.').lower()
+                # exclude empty strings from keys
+                if len(word) > 0:
+                    self.emit(word, 1)
 
     def emit(self, key, value):
-        self.tuples.append((key, value))
+        if self.collector is not None:
+            self.collector.emit(key, value)
+        else:
+            self.tuples.append((key, value))
 
 
 class Reducer:
@@ -34,6 +42,13 @@ class Reducer:
             self.reduce(t[0], t[1])
         return self.tuples
 
+    # groups - iterator of (key, iterator of values) sorted by key
+    def run_reduce_groups(self, groups):
+        self.tuples = []
+        for key, values in groups:
+            self.reduce(key, values)
+        return self.tuples
+
     @staticmethod
     def combine_data(data):
         if len(data) == 0:
@@ -64,3 +79,7 @@ class Reducer:
 
     def emit(self, key, value):
         self.tuples.append((key, value))
+
+
+# sum is associative, so reducer can be applied on the map side too
+Combiner = Reducer
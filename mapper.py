@@ -1,12 +1,21 @@
-import _thread
 import sys
 import uuid
 import os
-import json
 import cfg
-import importlib.util
+import inspect
+import heapq
+import time
+from operator import itemgetter
 from hash_partitioner import HashPartitioner
-from xmlrpc.client import ServerProxy
+from total_order_partitioner import TotalOrderPartitioner, KeySampler
+from collector import OutputCollector
+from aggregation import get_aggregation, HashAggregator, AggregateCombiner
+from input_format import get_input_format, read_split
+from serialization import get_serializer, compressed, compression_stats
+from slots import SlotExecutor
+from script_cache import ScriptCache, load_module
+from metrics import Metrics
+from xmlrpc.client import ServerProxy, Binary
 
 from fake_fs import FakeFS
 from enums import MapStatus, Status
@@ -14,12 +23,18 @@ from enums import MapStatus, Status
 
 # unique map task for one chunk
 class MapTask:
-    def __init__(self, task_id, rds_count, chunk_path, map_script):
+    def __init__(self, task_id, rds_count, chunk_path, map_script, split_points=None, input_format=None,
+                 codec=None):
         self.task_id = task_id
         self.status = MapStatus.accepted
         self.rds_count = rds_count
         self.chunk_path = chunk_path
         self.script_path = map_script
+        self.split_points = split_points  # if set then task is partitioned in total order
+        # name of input format, script gets iterator of records instead of the whole chunk if set
+        self.input_format = input_format
+        self.codec = codec  # spec of codec of map output, see serialization.get_codec, not compressed if None
+        self.metrics = Metrics()
 
     @property
     def in_progress(self):
@@ -27,16 +42,124 @@ class MapTask:
                and self.status != MapStatus.finished
 
 
+# combiner is optional: script opts in by defining a Combiner class
+# with the same contract as Reducer (run_reduce(list of tuples))
+def create_combiner(mod):
+    if not hasattr(mod, "Combiner"):
+        return None
+    return mod.Combiner()
+
+
+# records of the split if the task has input format, otherwise the split is the whole chunk
+def task_input(task, data):
+    if task.input_format is None:
+        return data
+    return get_input_format(task.input_format).records(data)
+
+
+# map script gets collector if its run_map accepts it, otherwise
+# tuples returned by the script are passed to the collector
+# script with map_batch returns arrays of keys and values which are passed to the collector at once
+def apply_map(mapper, data, collector):
+    if hasattr(mapper, "map_batch"):
+        keys, values = mapper.map_batch(data)
+        collector.emit_batch(keys, values)
+    elif "collector" in inspect.signature(mapper.run_map).parameters:
+        mapper.run_map(data, collector=collector)
+    else:
+        for t in mapper.run_map(data):
+            collector.emit(t[0], t[1])
+
+
+def _err(task, msg, e):
+    print("Task", task.task_id, ":", msg, e, file=sys.stderr)
+
+
+# executed in a map slot: load map script, apply it to the chunk data and save partitions to out_dir
+# task, script, data, partitioner and serializer are picklable, so it can be executed in another process
+# data - chunk data or Split if the task has input format
+# Return dict {status: MapStatus.partitions_saved, count: number of emitted tuples,
+# bytes: compression_stats of written runs and partitions if the task has codec,
+# metrics: Metrics.to_dict of the slot}
+def execute_map(task, script, data, partitioner, serializer, spill_dir, out_dir, spill_records):
+    metrics = Metrics()
+    try:
+        with metrics.timer("script_load"):
+            mod = load_module(script)
+            mapper = mod.Mapper()
+        mapper.counters = metrics.user
+        aggregation = get_aggregation(mod)
+        combiner = create_combiner(mod) if aggregation is None else AggregateCombiner(aggregation)
+    except Exception as e:
+        _err(task, "error during script execution", e)
+        return {'status': MapStatus.map_script_loading_error, 'count': 0}
+
+    output = OutputCollector(task.rds_count, partitioner, serializer, spill_dir, spill_records, combiner)
+    collector = output
+    if aggregation is not None:
+        # values are aggregated in a dict, so only partials of distinct keys are sorted and spilled
+        collector = HashAggregator(aggregation, output, spill_records)
+    try:
+        start = time.perf_counter()
+        apply_map(mapper, task_input(task, data), collector)
+        # spills and partitioning happen during the map, they are reported as own phases
+        metrics.timings["map"] += time.perf_counter() - start - output.spill_time - output.partition_time
+    except Exception as e:
+        _err(task, "Error during executing map script for chunk " + task.chunk_path, e)
+        return {'status': MapStatus.exec_map_error, 'count': collector.count}
+
+    try:
+        with metrics.timer("save"):
+            collector.save(out_dir)
+    except Exception as e:
+        _err(task, "Error during saving mapped partitions for chunk " + task.chunk_path, e)
+        return {'status': MapStatus.save_partitions_err, 'count': collector.count}
+
+    metrics.timings["spill"] += output.spill_time
+    metrics.timings["partition"] += output.partition_time
+    metrics.add("map_output_records", collector.count)
+    metrics.add("spilled_runs", sum(len(runs) for runs in output.runs.values()))
+    return {'status': MapStatus.partitions_saved, 'count': collector.count, 'bytes': compression_stats(serializer),
+            'metrics': metrics.to_dict()}
+
+
+# executed in a map slot: apply map script to the chunk and return random sample of emitted keys
+# Return dict {status: MapStatus.map_applied, keys: list of keys}
+def execute_sample(task, script, data, sample_size):
+    try:
+        mapper = load_module(script).Mapper()
+    except Exception as e:
+        _err(task, "error during script execution", e)
+        return {'status': MapStatus.map_script_loading_error, 'keys': []}
+
+    sampler = KeySampler(sample_size)
+    try:
+        apply_map(mapper, task_input(task, data), sampler)
+    except Exception as e:
+        _err(task, "Error during executing map script for chunk " + task.chunk_path, e)
+        return {'status': MapStatus.exec_map_error, 'keys': []}
+
+    return {'status': MapStatus.map_applied, 'keys': sampler.keys}
+
+
 class Mapper:
-    def __init__(self, opts, fs, name, my_addr):
+    # slots - executor of map tasks shared with reducer of the worker
+    # scripts - cache of downloaded scripts shared with reducer of the worker
+    def __init__(self, opts, fs, name, my_addr, slots=None, scripts=None):
         self.name = name
         self.my_addr = my_addr
         self.opts = opts
         self.fs = fs  # client to dfs
         self.work_dir = opts["base_dir"] + name
         self.tasks = {}
-        self.hasher = HashPartitioner()
-        self.job_tracker = ServerProxy(opts["jt_addr"])
+        self.running = {}  # (task_id, chunk_path) -> map task which is accepted and not finished
+        self.hasher = HashPartitioner(opts.get("partitioner", "legacy"))
+        self.serializer = get_serializer(opts.get("intermediate_format", "binary"))
+        self.spill_records = int(opts.get("spill_records", 10000))  # max tuples in region buffer before spill
+        self.slots = slots if slots is not None else SlotExecutor.from_opts(opts)
+        self.scripts = scripts if scripts is not None else ScriptCache(fs, self.work_dir + "/scripts")
+        # ServerProxy can not be shared by slots sending results concurrently, so every call creates its own
+        self.jt_addr = opts["jt_addr"]
 
     def log(self, task_id, msg):
         print("Task", task_id, ":", msg)
@@ -50,7 +173,11 @@ class Mapper:
     # chunk_path - DFS path to the chunk file to map
     # map_script - DFS path to script of map function
     # restart_task - if True then restart map task even its already completed or executing now
-    def map(self, task_id, rds_count, chunk_path, map_script, restart_task=False):
+    # split_points - keys separating regions for total order partitioning, hash partitioning if None
+    # input_format - name of input format, see input_format.get_input_format, the whole chunk is mapped if None
+    # codec - spec of codec which compresses map output, see serialization.get_codec
+    def map(self, task_id, rds_count, chunk_path, map_script, restart_task=False, split_points=None,
+            input_format=None, codec=None):
         print("Map request - task_id:", task_id, "rdc_count:", rds_count, "chunk_path:", chunk_path,
               "map_script:", map_script, "restart_task:", restart_task)
 
@@ -61,111 +188,159 @@ class Mapper:
         if task_id not in self.tasks:
             self.tasks[task_id] = {}
 
-        self.tasks[task_id][chunk_path] = MapTask(task_id, rds_count, chunk_path, map_script)
-        _thread.start_new_thread(self.process_task, (self.tasks[task_id][chunk_path],))
+        task = MapTask(task_id, rds_count, chunk_path, map_script, split_points, input_format, codec)
+        self.tasks[task_id][chunk_path] = task
+        self.running[(task_id, chunk_path)] = task
+        self.slots.submit_map(self._run_task, task)
 
         return {'status': MapStatus.accepted}
 
+    # JT is notified about failed tasks, so that their chunks are mapped again
+    def _run_task(self, task):
+        try:
+            self.process_task(task)
+        except Exception as e:
+            task.status = MapStatus.error
+            self.err(task.task_id, "Error during processing chunk " + task.chunk_path, e)
+
+        if task.status != MapStatus.finished:
+            self.send_mapping_failed(task.task_id, task.chunk_path)
+        self.running.pop((task.task_id, task.chunk_path), None)
+
+    # map tasks which are accepted and not finished, reported to JT in heartbeats
+    # Return list of dicts {kind: map, task_id, item: chunk path, status}
+    def get_progress(self):
+        return [{'kind': 'map', 'task_id': str(t.task_id), 'item': t.chunk_path, 'status': t.status}
+                for t in list(self.running.values())]
+
     def process_task(self, task):
         task_id = task.task_id
         self.log(task_id, "start task")
         self.log(task_id, "trying to load chunk " + task.chunk_path)
 
-        r = self.fs.get_chunk(task.chunk_path)
-        if r['status'] == Status.not_found:
-            task.status = MapStatus.chunk_not_found
-            return
+        with task.metrics.timer("chunk_load"):
+            r = self.fs.get_chunk(task.chunk_path)
+            if r['status'] == Status.not_found:
+                task.status = MapStatus.chunk_not_found
+                return
 
+            data = self._read_split(task, r['data'])
+        task.metrics.add("map_input_bytes", len(r['data']))
         self.log(task_id, "chunk " + task.chunk_path + " has been loaded")
         task.status = MapStatus.chunk_loaded
-        mapper = self.load_mapping_script(task)
+        with task.metrics.timer("script_load"):
+            script = self.load_mapping_script(task)
 
         if task.status == MapStatus.mapper_loaded:
-            tuples = self.exec_mapping(mapper, task, r['data'])
-            if task.status == MapStatus.map_applied:
-                regions = self.partition(task.rds_count, tuples)
-                self.save_partitions(task, task.chunk_path, regions)
-
-                if task.status == MapStatus.partitions_saved:
-                    task.status = MapStatus.partitions_saved
-                    self.send_mapping_done(task_id, task.chunk_path)
-                    task.status = MapStatus.finished
-
+            self.log(task_id, "start mapping execution")
+            task_dir = self._get_chunk_dir_path(task_id, task.chunk_path)
+            spill_dir = self.work_dir + "/" + str(task_id) + "/spill" + task.chunk_path
+            try:
+                res = self.slots.run(execute_map, task, script, data, self.get_partitioner(task),
+                                     compressed(self.serializer, task.codec), spill_dir, task_dir,
+                                     self.spill_records)
+            except Exception as e:
+                self.err(task_id, "Map slot failed for chunk " + task.chunk_path, e)
+                res = {'status': MapStatus.exec_map_error, 'count': 0}
+            task.status = res['status']
+            task.metrics.update(res.get('metrics', {}))
+            self.log(task_id, "mapping function completed, tuples count - " + str(res['count']))
+
+            if task.status == MapStatus.partitions_saved:
+                self.log(task_id, "saved map result of " + task.chunk_path + " to " + task_dir)
+                stats = res.get('bytes')
+                if stats is not None:
+                    self.log(task_id, "compressed map output from " + str(stats['raw']) + " to " +
+                             str(stats['stored']) + " bytes")
+                task.metrics.add("map_output_bytes", sum(os.path.getsize(os.path.join(task_dir, f))
+                                                         for f in os.listdir(task_dir)))
+                self.send_mapping_done(task_id, task.chunk_path, stats, task.metrics.to_dict())
+                task.status = MapStatus.finished
+
+    # download map script to work dir unless it is downloaded for the task
+    # Return LocalScript
     def load_mapping_script(self, task):
         try:
-            l_path = self.work_dir + "/" + str(task.task_id) + "/map.py"
-            r = self.fs.download_to(task.script_path, l_path)
-            if r['status'] == Status.not_found:
+            script = self.scripts.get(task.task_id, task.script_path)
+            if script is None:
                 task.status = MapStatus.map_script_not_found
                 return None
 
-            spec = importlib.util.spec_from_file_location("map"+str(task.task_id), l_path)
-            mod = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(mod)
             task.status = MapStatus.mapper_loaded
-            return mod.Mapper()
+            return script
         except Exception as e:
-            self.err(task.task_id, "error during script execution", e)
+            self.err(task.task_id, "error during script loading", e)
             task.status = MapStatus.map_script_loading_error
             return None
 
-    def exec_mapping(self, mapper, task, data):
-        try:
-            self.log(task.task_id, "start mapping execution")
-            tuples = mapper.run_map(data)
-            self.log(task.task_id, "mapping function completed, tuples count - " + str(len(tuples)))
-            task.status = MapStatus.map_applied
-            return tuples
-        except Exception as e:
-            self.err(task.task_id, "Error during executing map script for chunk " + task.chunk_path, e)
-            task.status = task.status = MapStatus.exec_map_error
-            return []
+    # records crossing the end of the chunk are read from next chunks
+    # Return Split if the task has input format, otherwise data of the chunk
+    def _read_split(self, task, data):
+        if task.input_format is None:
+            return data
+        return read_split(self.fs, get_input_format(task.input_format), task.chunk_path, data)
 
-    def partition(self, rds_count, tuples):
-        regions = {}
-        for i in range(1, rds_count + 1):
-            regions[i] = []
+    # serializer of map output of the task, map outputs of a task have the same codec
+    def task_serializer(self, task_id):
+        codec = next((t.codec for t in list(self.tasks.get(task_id, {}).values())), None)
+        return compressed(self.serializer, codec)
 
-        for t in tuples:
-            r = self.hasher.get_partition(t[0], t[1], rds_count)
-            regions[r+1].append(t)
-
-        for k,v in regions.items():
-            v.sort(key=lambda tup: tup[0])
-
-        return regions
+    def get_partitioner(self, task):
+        if task.split_points is not None:
+            return TotalOrderPartitioner(task.split_points)
+        return self.hasher
 
+    # map output is saved in path /base_dir/task_id/chunk_path/1 where 1 is a region number
     def _get_chunk_dir_path(self, task_id, chunk_path):
         return self.work_dir + "/" + str(task_id) + chunk_path
 
-    # save file in path /base_dir/task_id/chunk_path/1 where 1 is a region number
-    # task_id - unique task_id
-    # chunk_path - path of the processed_chunk
-    # dictionary of mapped data which is sorted to regions
-    def save_partitions(self, task, chunk_path, regions):
-        try:
-            task_dir = self._get_chunk_dir_path(task.task_id, chunk_path)
-            self.log(task.task_id, "save map result of " + chunk_path + " to " + task_dir)
-            if not os.path.exists(task_dir):
-                os.makedirs(task_dir)
+    # apply map script to the chunk and return random sample of emitted keys,
+    # used by JT to compute split points of total order partitioning
+    # Return dict {status: Status.ok, keys: list of keys}
+    def sample(self, task_id, chunk_path, map_script, sample_size, input_format=None):
+        task = MapTask(task_id, 1, chunk_path, map_script, None, input_format)
+        r = self.fs.get_chunk(chunk_path)
+        if r['status'] == Status.not_found:
+            return {'status': Status.not_found, 'keys': []}
+        data = self._read_split(task, r['data'])
 
-            for k, v in regions.items():
-                path = task_dir + "/" + str(k)
-                with open(path, 'w') as file:
-                    file.write(json.dumps(v))
-            task.status = MapStatus.partitions_saved
+        script = self.load_mapping_script(task)
+        if task.status != MapStatus.mapper_loaded:
+            return {'status': Status.error, 'keys': []}
 
+        try:
+            res = self.slots.run(execute_sample, task, script, data, sample_size)
         except Exception as e:
-            self.log(task_id, "Error during saving mapped partitions for chunk " + chunk_path, e)
-            task.status = MapStatus.save_partitions_err
+            self.err(task_id, "Map slot failed for chunk " + chunk_path, e)
+            return {'status': Status.error, 'keys': []}
+
+        if res['status'] != MapStatus.map_applied:
+            return {'status': Status.error, 'keys': []}
 
-    def send_mapping_done(self, task_id, chunk_path):
+        self.log(task_id, "sampled " + str(len(res['keys'])) + " keys of " + chunk_path)
+        return {'status': Status.ok, 'keys': res['keys']}
+
+    # stats - compression_stats of map output, sent if the task has codec
+    # metrics - Metrics.to_dict of the map task
+    def send_mapping_done(self, task_id, chunk_path, stats=None, metrics=None):
         try:
-            self.job_tracker.mapping_done(self.my_addr, str(task_id), chunk_path)
+            args = (self.my_addr, str(task_id), chunk_path)
+            if stats is not None or metrics is not None:
+                args += (stats or {},)
+            if metrics is not None:
+                args += (metrics,)
+            ServerProxy(self.jt_addr).mapping_done(*args)
             self.log(task_id, "Sent message to job tracker about finishing mapping of " + chunk_path)
         except Exception as e:
             self.err(task_id, "Failed to send result for chunk " + chunk_path, e)
 
+    def send_mapping_failed(self, task_id, chunk_path):
+        try:
+            ServerProxy(self.jt_addr).mapping_failed(self.my_addr, str(task_id), chunk_path)
+            self.log(task_id, "Sent message to job tracker about failed mapping of " + chunk_path)
+        except Exception as e:
+            self.err(task_id, "Failed to send failure for chunk " + chunk_path, e)
+
     def get_status(self, task_id, chunk_path):
         if task_id not in self.tasks and chunk_path not in self.tasks[task_id]:
             return {'status': MapStatus.chunk_not_found}
@@ -176,19 +351,24 @@ class Mapper:
     # read mapped data for specific region
     # task_id - unique task_id
     # region - is a integer region which is specified for the current reducer
-    # Return dict {status: Status.ok, data: list of tuples}
+    # chunk_paths - chunks whose output is read, all chunks of the task if None
+    # Return dict {status: Status.ok, format: name of serializer, data: serialized tuples sorted by key}
     # if file not exists then status = Status.not_found
-    # if file is empty then returns ok and empty list
-    def read_mapped_data(self, task_id, region_number):
+    # if file is empty then returns ok and empty data
+    def read_mapped_data(self, task_id, region_number, chunk_paths=None):
         try:
             self.log(task_id, "request to load region " + str(region_number))
 
             if task_id not in self.tasks:
                 return {'status': Status.not_found, 'data': []}
 
-            result = []
+            runs = []
+            serializer = self.task_serializer(task_id)
 
             for chunk_path in self.tasks[task_id]:
+                if chunk_paths is not None and chunk_path not in chunk_paths:
+                    continue
+
                 path = self._get_chunk_dir_path(task_id, chunk_path)
                 path += "/" + str(region_number)
 
@@ -196,13 +376,13 @@ class Mapper:
                     self.log(task_id, "chunk " + path + " is not found in mapped data")
                     continue
 
-                with open(path, "r") as f:
-                    list = json.loads(f.read())
+                runs.append(serializer.load(path))
 
-                result.extend([(x[0], x[1]) for x in list])
+            # every region file is sorted, so reducer gets one sorted stream from the mapper
+            data = serializer.dumps(heapq.merge(*runs, key=itemgetter(0)))
 
             self.log(task_id, "Send to reducer data for region " + str(region_number))
-            return {'status': Status.ok, 'data': result}
+            return {'status': Status.ok, 'format': serializer.name, 'data': Binary(data)}
         except Exception as e:
             self.log(task_id, "Error during loading region " + str(region_number) + ": " + str(e))
             return {'status': Status.error, 'data': []}
@@ -0,0 +1,40 @@
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+# counters of a script, available to Mapper and Reducer of the script as self.counters
+class Counters(Counter):
+    def increment(self, name, amount=1):
+        self[str(name)] += amount
+
+
+# Metrics of one map or reduce attempt: counters of records and bytes,
+# seconds spent in phases and counters incremented by the script.
+# Metrics of a slot process are passed back in its result as dict and merged with update.
+class Metrics:
+    def __init__(self):
+        self.counters = Counter()
+        self.timings = Counter()
+        self.user = Counters()
+
+    def add(self, name, amount=1):
+        self.counters[name] += amount
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] += time.perf_counter() - start
+
+    # d - dict returned by to_dict
+    def update(self, d):
+        self.counters.update(d.get('counters', {}))
+        self.timings.update(d.get('timings', {}))
+        self.user.update(d.get('user', {}))
+
+    # Return dict {counters, timings, user} which can be sent by xml-rpc
+    def to_dict(self):
+        return {'counters': dict(self.counters), 'timings': dict(self.timings), 'user': dict(self.user)}
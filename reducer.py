@@ -1,15 +1,39 @@
 #!/usr/bin/env python3
-import _thread
+import threading
 import sys
 import cfg
 import uuid
 from xmlrpc.client import ServerProxy
 from enums import ReduceStatus, Status
 from fake_fs import FakeFS
+from serialization import get_serializer, get_codec, compressed, BinarySerializer
+from slots import SlotExecutor
+from script_cache import ScriptCache, load_module
+from aggregation import get_aggregation, reduce_partials
+from metrics import Metrics
 import map_libs.word_count
 import os
-import importlib.util
+import shutil
+import http.client
+import heapq
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, quote
 import json
+import base64
+from itertools import groupby
+from operator import itemgetter
+
+
+# merge streams of tuples sorted by key into one sorted stream
+def merge_sorted(streams):
+    return heapq.merge(*streams, key=itemgetter(0))
+
+
+# group sorted stream of tuples, yields (key, iterator of values)
+def group_sorted(tuples):
+    for key, group in groupby(tuples, key=itemgetter(0)):
+        yield key, (t[1] for t in group)
 
 
 # fake mapper client for testing
@@ -18,7 +42,7 @@ class FakeMapperClient:
     def __init__(self):
         self.data = {}
 
-    def load_mapped_data(self, map_addr, task_id, region):
+    def load_mapped_data(self, map_addr, task_id, region, chunk_paths=None):
         if map_addr not in self.data and task_id not in self.data[map_addr] \
                 and region not in self.data[map_addr][task_id]:
             return {'status': Status.not_found}
@@ -35,30 +59,222 @@ class FakeMapperClient:
         self.data[map_addr][task_id][region] = data
 
 
+# pool of persistent connections to mappers, idle connections are kept per address
+# factory - function which creates new connection for the address
+class ConnectionPool:
+    def __init__(self, factory):
+        self.factory = factory
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, addr):
+        with self.lock:
+            conns = self.idle.get(addr)
+            if conns:
+                return conns.pop()
+        return self.factory(addr)
+
+    def release(self, addr, conn):
+        with self.lock:
+            self.idle.setdefault(addr, []).append(conn)
+
+
 class RPCMapperClient:
-    def load_mapped_data(self, map_addr, task_id, region):
-        cl = ServerProxy(map_addr)
-        return cl.read_mapped_data(task_id, region)['data']
+    def __init__(self):
+        self.pool = ConnectionPool(ServerProxy)
+
+    # returns iterator over tuples of the region sorted by key
+    # chunk_paths - chunks whose output is loaded, all chunks of the mapper if None
+    def load_mapped_data(self, map_addr, task_id, region, chunk_paths=None):
+        cl = self.pool.acquire(map_addr)
+        if chunk_paths is None:
+            r = cl.read_mapped_data(task_id, region)
+        else:
+            r = cl.read_mapped_data(task_id, region, chunk_paths)
+        self.pool.release(map_addr, cl)
+        if r['status'] == Status.not_found:
+            return []
+        if r['status'] != Status.ok:
+            raise Exception("mapper " + map_addr + " failed to read region " + str(region))
+
+        return get_serializer(r['format']).loads(r['data'].data)
+
+
+# client which downloads map output from shuffle servers of mappers
+# work_dir - directory for downloaded region files
+# port - port of shuffle server, the same for all workers
+class HTTPMapperClient:
+    def __init__(self, work_dir, port):
+        self.work_dir = work_dir
+        self.port = port
+        self.pool = ConnectionPool(lambda host: http.client.HTTPConnection(host, self.port))
+
+    # returns iterator over tuples of the region sorted by key
+    # chunk_paths - chunks whose output is loaded, all chunks of the mapper if None
+    def load_mapped_data(self, map_addr, task_id, region, chunk_paths=None):
+        host = urlsplit(map_addr).hostname
+        conn = self.pool.acquire(host)
+        try:
+            index = json.loads(self._get(conn, "/" + str(task_id) + "/" + str(region)).read().decode('utf-8'))
+            serializer = get_serializer(index['format'])
+
+            l_dir = self.work_dir + "/" + str(task_id) + "/shuffle/" + str(region) + "/" + host
+            os.makedirs(l_dir, exist_ok=True)
+
+            paths = []
+            chunks = index['chunks']
+            if chunk_paths is not None:
+                chunks = [c for c in chunks if c in chunk_paths]
+
+            # chunks of one mapper may be fetched by several calls and the index lists only mapped chunks,
+            # so files are named by chunk paths which do not change between calls
+            for chunk_path in chunks:
+                name = quote(chunk_path, safe='')
+                url = "/" + str(task_id) + "/" + str(region) + "?chunk=" + name
+                path = l_dir + "/" + name
+                with open(path, 'wb') as f:
+                    shutil.copyfileobj(self._get(conn, url), f, 1 << 20)
+                paths.append(path)
+        except Exception:
+            conn.close()
+            raise
+
+        self.pool.release(host, conn)
+        return merge_sorted([serializer.load(path) for path in paths])
+
+    @staticmethod
+    def _get(conn, url):
+        conn.request("GET", url)
+        r = conn.getresponse()
+        if r.status != 200:
+            r.read()
+            raise Exception("shuffle server returned " + str(r.status) + " for " + url)
+        return r
+
+
+# Merges sorted streams as they arrive from mappers. Every merge_factor streams
+# are merged to a run on disk, so that merging goes along with fetching
+# and final merge has bounded number of inputs.
+class RunMerger:
+    def __init__(self, serializer, work_dir, merge_factor):
+        self.serializer = serializer
+        self.work_dir = work_dir
+        self.merge_factor = merge_factor
+        self.pending = []
+        self.runs = []
+
+    def add(self, stream):
+        self.pending.append(stream)
+        if len(self.pending) >= self.merge_factor:
+            self._merge_pending()
+
+    def _merge_pending(self):
+        os.makedirs(self.work_dir, exist_ok=True)
+        path = self.work_dir + "/merged_" + str(len(self.runs))
+        self.serializer.dump(merge_sorted(self.pending), path)
+        self.runs.append(path)
+        self.pending = []
+
+    # merge the rest of arrived streams to disk
+    # Return paths of all runs for the final merge
+    def paths(self):
+        if len(self.pending) > 0:
+            self._merge_pending()
+        return self.runs
+
+
+# executed in a reduce slot: load reduce script and apply it to merged runs
+# task, script and serializer are picklable, so it can be executed in another process
+# if script declares Aggregate then partials of runs are merged in a dict without merging runs,
+# if script has reduce_batch then merged runs are passed to it in blocks of arrays,
+# if script has run_reduce_groups then runs are merged and passed
+# to it group by group, otherwise script gets all tuples in one list
+# Return dict {status: ReduceStatus.data_reduced, result: list of reduced tuples, metrics: Metrics.to_dict of the slot}
+def execute_reduce(task, script, paths, serializer):
+    metrics = Metrics()
+    try:
+        with metrics.timer("script_load"):
+            mod = load_module(script)
+            aggregation = get_aggregation(mod)
+            reducer = mod.Reducer() if aggregation is None else None
+        if reducer is not None:
+            reducer.counters = metrics.user
+    except Exception as e:
+        print("Task", task.task_id, ":", "error during script execution", e, file=sys.stderr)
+        return {'status': ReduceStatus.err_reducer_loading, 'result': []}
+
+    try:
+        with metrics.timer("reduce"):
+            streams = [serializer.load(path) for path in paths]
+            if aggregation is not None:
+                r = reduce_partials(aggregation, streams)
+            elif hasattr(reducer, "reduce_batch"):
+                from batch import reduce_sorted
+                r = reduce_sorted(reducer, merge_sorted(streams))
+            elif hasattr(reducer, "run_reduce_groups"):
+                r = reducer.run_reduce_groups(group_sorted(merge_sorted(streams)))
+            else:
+                data = []
+                for stream in streams:
+                    data.extend(stream)
+                r = reducer.run_reduce(data)
+        metrics.add("reduce_output_records", len(r))
+        return {'status': ReduceStatus.data_reduced, 'result': r, 'metrics': metrics.to_dict()}
+    except Exception as e:
+        print("Task", task.task_id, ":", "Error during executing reducer script", e, file=sys.stderr)
+        return {'status': ReduceStatus.err_reduce_script, 'result': []}
 
 
 class ReduceTask:
-    def __init__(self, task_id, region, mappers, script_path):
+    # maps_done - False if the reducer is started before the end of mapping
+    # and outputs of the rest of maps are announced by JT
+    # codec - spec of codec of merged runs and the result, see serialization.get_codec
+    def __init__(self, task_id, region, mappers, script_path, maps_done=True, codec=None):
         self.task_id = task_id
         self.region = region
         self.mappers = mappers
+        # events of loading data: ("maps", (mappers, maps_done)) from JT and ("fetched", future) from fetchers
+        self.events = queue.Queue()
+        self.events.put(("maps", (mappers, maps_done)))
         self.status = ReduceStatus.accepted
         self.script_path = script_path
+        # backup attempts of a region may run concurrently, each saves its result to its own path
+        self.attempt = uuid.uuid4().hex[:8]
+        self.result_path = "/" + str(task_id) + "/result/" + str(region) + "_" + self.attempt
+        self.codec = codec
+        self.stats = None  # {raw, stored} sizes of the result if the task has codec
+        self.metrics = Metrics()
+        if codec:
+            # readers of the result know its codec by the extension
+            self.result_path += "." + get_codec(codec).name
+
+    # task is passed to reduce slot which may be another process, queue of events is not needed there
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['events']
+        return state
 
 
 class Reducer:
-    def __init__(self, fs, name, addr, opts, mapper_cl):
+    # slots - executor of reduce tasks shared with mapper of the worker
+    # scripts - cache of downloaded scripts shared with mapper of the worker
+    def __init__(self, fs, name, addr, opts, mapper_cl, slots=None, scripts=None):
         self.fs = fs
         self.name = name
         self.addr = addr
-        self.job_tracker = ServerProxy(opts["jt_addr"])
+        # ServerProxy can not be shared by slots sending results concurrently, so every call creates its own
+        self.jt_addr = opts["jt_addr"]
         self.tasks = {}
+        self.running = {}  # (task_id, region) -> reduce task which is accepted and not finished
         self.mapper_cl = mapper_cl  # client for loading data from mappers
         self.work_dir = opts["base_dir"] + name
+        self.fetchers = int(opts.get("shuffle_fetchers", 4))  # number of mappers fetched concurrently
+        self.merge_factor = int(opts.get("shuffle_merge_factor", 10))
+        # loading fails if JT has not announced map outputs for so many seconds
+        self.map_wait_timeout = float(opts.get("shuffle_wait_timeout", 60))
+        self.serializer = BinarySerializer()  # format of merged runs
+        self.slots = slots if slots is not None else SlotExecutor.from_opts(opts)
+        self.scripts = scripts if scripts is not None else ScriptCache(fs, self.work_dir + "/scripts")
 
     def log(self, task_id, msg):
         print("Task", task_id, ":", msg)
@@ -71,79 +287,170 @@ class Reducer:
     # region for which reducer is responsible
     # mappers which contain data for current task
     # path in DFS to files
-    def reduce(self, task_id, region, mappers, script_path):
+    # maps_done - False if some chunks are not mapped yet, their outputs are passed to add_map_outputs
+    # codec - spec of codec which compresses merged runs and the result
+    def reduce(self, task_id, region, mappers, script_path, maps_done=True, codec=None):
         self.log(task_id, "Get request for start reducing of region " + str(region))
         if task_id not in self.tasks:
             self.tasks[task_id] = {}
 
-        task = ReduceTask(task_id, region, mappers, script_path)
+        task = ReduceTask(task_id, region, mappers, script_path, maps_done, codec)
         self.tasks[task_id][region] = task
-        _thread.start_new_thread(self._process_reduce_task, (task, ))
+        self.running[(task_id, region)] = task
+        self.slots.submit_reduce(self._run_reduce_task, task)
         return {'status': ReduceStatus.accepted}
 
+    # completed maps announced by JT for reduce tasks of the task_id which are loading data
+    # mappers - list of [address, list of chunk paths], all completed maps of the task
+    # maps_done - True if all chunks of the task are mapped
+    def add_map_outputs(self, task_id, mappers, maps_done):
+        for task in list(self.running.values()):
+            if str(task.task_id) == task_id and task.status in (ReduceStatus.accepted, ReduceStatus.start_data_loading):
+                task.events.put(("maps", (mappers, maps_done)))
+
+    # reduce tasks which are accepted and not finished, reported to JT in heartbeats
+    # Return list of dicts {kind: reduce, task_id, item: region, status}
+    def get_progress(self):
+        return [{'kind': 'reduce', 'task_id': str(t.task_id), 'item': t.region, 'status': t.status}
+                for t in list(self.running.values())]
+
+    def _run_reduce_task(self, task):
+        try:
+            self._process_reduce_task(task)
+        except Exception as e:
+            self.err(task.task_id, "Error during processing region " + str(task.region), e)
+        self.running.pop((task.task_id, task.region), None)
+
     def _process_reduce_task(self, task):
-        data = self._load_data_from_mappers(task)
+        with task.metrics.timer("shuffle"):
+            paths = self._load_data_from_mappers(task)
 
         if task.status == ReduceStatus.data_loaded:
-            reducer = self._load_reduce_script(task)
+            task.metrics.add("reduce_input_bytes", sum(os.path.getsize(path) for path in paths))
+            with task.metrics.timer("script_load"):
+                script = self._load_reduce_script(task)
             if task.status == ReduceStatus.reducer_loaded:
-                result = self.execute_reduce_script(reducer, task, data)
+                result = self.execute_reduce_script(task, script, paths)
 
                 if task.status == ReduceStatus.data_reduced:
-                    self._save_result_to_dfs(task, result)
+                    with task.metrics.timer("save"):
+                        self._save_result_to_dfs(task, result)
 
                     if task.status == ReduceStatus.data_saved:
                         self._send_reducing_done(task)
 
+        shutil.rmtree(self._shuffle_dir(task), ignore_errors=True)
+        if task.status != ReduceStatus.finished and task.status != ReduceStatus.err_send_done:
+            self._send_reducing_failed(task)
+
+    def _shuffle_dir(self, task):
+        return self.work_dir + "/" + str(task.task_id) + "/shuffle/" + str(task.region)
+
     def _load_data_from_mappers(self, task):
         try:
             self.log(task.task_id, "Start loading data from mappers to region " + str(task.region))
             task.status = ReduceStatus.start_data_loading
-            result = []
-            for mapper in task.mappers:
-                data = self.mapper_cl.load_mapped_data(mapper, task.task_id, task.region)
-                result.extend(data)
+            merger = RunMerger(compressed(self.serializer, task.codec), self._shuffle_dir(task), self.merge_factor)
+            fetched = set()
+            fetching = 0
+            maps_done = False
+
+            # outputs are fetched as maps are announced until the last map is done
+            with ThreadPoolExecutor(max_workers=self.fetchers) as executor:
+                while not maps_done or fetching > 0:
+                    try:
+                        event, value = task.events.get(timeout=self.map_wait_timeout)
+                    except queue.Empty:
+                        raise Exception("no map outputs announced for " + str(self.map_wait_timeout) + " seconds")
+
+                    if event == "fetched":
+                        fetching -= 1
+                        merger.add(value.result())
+                        continue
+
+                    mappers, maps_done = value
+                    for mapper in self._new_outputs(mappers, fetched):
+                        fetching += 1
+                        f = executor.submit(self._load_from_mapper, mapper, task)
+                        f.add_done_callback(lambda f: task.events.put(("fetched", f)))
 
             task.status = ReduceStatus.data_loaded
-            return result
+            return merger.paths()
         except Exception as e:
             task.status = ReduceStatus.err_data_loading
-            self.err(task.task_id, "Error during loading data for region " + str(region), e)
-
+            self.err(task.task_id, "Error during loading data for region " + str(task.region), e)
+
+    # mapper - address of mapper or [address, list of chunk paths] if only output of these chunks
+    # belongs to the job, e.g. other chunks of the mapper were completed by backup attempts
+    def _load_from_mapper(self, mapper, task):
+        if isinstance(mapper, str):
+            return self.mapper_cl.load_mapped_data(mapper, task.task_id, task.region)
+
+        map_addr, chunk_paths = mapper
+        return self.mapper_cl.load_mapped_data(map_addr, task.task_id, task.region, chunk_paths)
+
+    # outputs of mappers which are not fetched yet, output of a chunk is fetched once
+    # even if the chunk is mapped again by another worker
+    # fetched - chunk paths and addresses of mappers whose output is fetched, updated
+    @staticmethod
+    def _new_outputs(mappers, fetched):
+        new = []
+        for mapper in mappers:
+            if isinstance(mapper, str):
+                if mapper not in fetched:
+                    fetched.add(mapper)
+                    new.append(mapper)
+                continue
+
+            map_addr, chunk_paths = mapper
+            chunk_paths = [path for path in chunk_paths if path not in fetched]
+            if len(chunk_paths) > 0:
+                fetched.update(chunk_paths)
+                new.append([map_addr, chunk_paths])
+        return new
+
+    # download reduce script to work dir unless it is downloaded for the task
+    # Return LocalScript
     def _load_reduce_script(self, task):
         try:
-            l_path = self.work_dir + "/" + str(task.task_id) + "/reduce.py"
-            r = self.fs.download_to(task.script_path, l_path)
-            if r['status'] == Status.not_found:
+            script = self.scripts.get(task.task_id, task.script_path)
+            if script is None:
                 task.status = ReduceStatus.reduce_script_not_found
                 return None
 
-            spec = importlib.util.spec_from_file_location("reduce" + str(task.task_id), l_path)
-            mod = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(mod)
             task.status = ReduceStatus.reducer_loaded
-            return mod.Reducer()
+            return script
         except Exception as e:
-            self.err(task.task_id, "error during script execution", e)
+            self.err(task.task_id, "error during script loading", e)
             task.status = ReduceStatus.err_reducer_loading
             return None
 
-    def execute_reduce_script(self, reducer, task, data):
+    # paths - sorted runs of shuffled data
+    def execute_reduce_script(self, task, script, paths):
+        self.log(task.task_id, "Start reducing script " + task.script_path)
         try:
-            self.log(task.task_id, "Start loading reducing script for executing " + task.script_path)
-            r = reducer.run_reduce(data)
-            task.status = ReduceStatus.data_reduced
-            return r
+            res = self.slots.run(execute_reduce, task, script, paths, compressed(self.serializer, task.codec))
         except Exception as e:
-            task.status = ReduceStatus.err_reduce_script
-            self.err("Error during executing reducer script", e)
+            self.err(task.task_id, "Reduce slot failed for region " + str(task.region), e)
+            res = {'status': ReduceStatus.err_reduce_script, 'result': []}
+
+        task.status = res['status']
+        task.metrics.update(res.get('metrics', {}))
+        return res['result']
 
-    # save reduced result to dfs
+    # save reduced result to dfs, compressed result is encoded with base64 as DFS stores text
     def _save_result_to_dfs(self, task, result):
         try:
-            path = "/" + str(task.task_id) + "/result/" + str(task.region)
+            path = task.result_path
             self.log(task.task_id, "Save result of region " + str(task.region) + " to " + path)
-            self.fs.save(json.dumps(result), path)
+            data = json.dumps(result)
+            if task.codec:
+                raw = data.encode('utf-8')
+                data = base64.b64encode(get_codec(task.codec).compress(raw)).decode('ascii')
+                task.stats = {'raw': len(raw), 'stored': len(data)}
+                self.log(task.task_id, "compressed result from " + str(len(raw)) + " to " + str(len(data)) + " bytes")
+            self.fs.save(data, path)
+            task.metrics.add("result_bytes", len(data))
             task.status = ReduceStatus.data_saved
         except Exception as e:
             task.status = ReduceStatus.err_save_result
@@ -151,13 +458,22 @@ class Reducer:
 
     def _send_reducing_done(self, task):
         try:
-            self.job_tracker.reducing_done(self.addr, str(task.task_id), task.region)
+            args = (self.addr, str(task.task_id), task.region, task.result_path, task.stats or {},
+                    task.metrics.to_dict())
+            ServerProxy(self.jt_addr).reducing_done(*args)
             self.log(task.task_id, "Sent message to job tracker about finishing reducing of region " + str(task.region))
             task.status = ReduceStatus.finished
         except Exception as e:
             task.status = ReduceStatus.err_send_done
             self.err(task.task_id, "Failed to send result to JT for region " + str(task.region), e)
 
+    def _send_reducing_failed(self, task):
+        try:
+            ServerProxy(self.jt_addr).reducing_failed(self.addr, str(task.task_id), task.region)
+            self.log(task.task_id, "Sent message to job tracker about failed reducing of region " + str(task.region))
+        except Exception as e:
+            self.err(task.task_id, "Failed to send failure to JT for region " + str(task.region), e)
+
     # get status of current reducer execution
     # task_id - unique task_id
     # region - regions of keys which reducer should reduce
@@ -196,5 +512,5 @@ if __name__ == '__main__':
     while reducer.get_status(task_id, region)['status'] != ReduceStatus.err_send_done:
         pass
 
-    reg_1 = fs.get_chunk("/"+str(task_id) + "/result/" + str(region))
+    reg_1 = fs.get_chunk(reducer.tasks[task_id][region].result_path)
     print('reduce has finished', reg_1)
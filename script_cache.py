@@ -0,0 +1,103 @@
+import hashlib
+import importlib.util
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from enums import Status
+
+CACHE_SIZE = 16  # scripts kept by a worker and modules kept by every process executing scripts
+
+
+class LRUCache:
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+def load_script(l_path, name):
+    spec = importlib.util.spec_from_file_location(name, l_path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+# script in the local file system
+# key - (DFS path of the script, sha256 of its content), identifies the module of the script
+class LocalScript:
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+
+    @staticmethod
+    def from_file(path):
+        with open(path, 'rb') as f:
+            return LocalScript(path, (path, hashlib.sha256(f.read()).hexdigest()))
+
+
+modules = LRUCache(CACHE_SIZE)
+
+
+# module of the script, the script is executed once per content in every process,
+# so tasks of a job and map and reduce sides share the module
+def load_module(script):
+    mod = modules.get(script.key)
+    if mod is None:
+        mod = load_script(script.path, "script_" + script.key[1])
+        modules.put(script.key, mod)
+    return mod
+
+
+# Scripts downloaded from DFS by a worker, shared by its mapper and reducer.
+# Script of a task does not change, so it is downloaded once per task, not for every chunk or region.
+# Files are named by hash of content, so tasks with the same script share the file and the module.
+class ScriptCache:
+    def __init__(self, fs, work_dir):
+        self.fs = fs
+        self.work_dir = work_dir
+        self.scripts = LRUCache(CACHE_SIZE)  # (task_id, DFS path) -> LocalScript
+        self.lock = threading.Lock()  # concurrent tasks of a job wait for one download
+
+    # Return LocalScript or None if the script is not found in DFS
+    def get(self, task_id, script_path):
+        key = (str(task_id), script_path)
+        script = self.scripts.get(key)
+        if script is not None:
+            return script
+
+        with self.lock:
+            script = self.scripts.get(key)
+            if script is not None:
+                return script
+
+            os.makedirs(self.work_dir, exist_ok=True)
+            tmp_path = self.work_dir + "/" + str(uuid.uuid4())
+            r = self.fs.download_to(script_path, tmp_path)
+            if r['status'] == Status.not_found:
+                return None
+
+            with open(tmp_path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            # file may be read by running tasks, so it is replaced atomically
+            l_path = self.work_dir + "/" + digest + ".py"
+            os.replace(tmp_path, l_path)
+
+            script = LocalScript(l_path, (script_path, digest))
+            self.scripts.put(key, script)
+            return script
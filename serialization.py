@@ -0,0 +1,320 @@
+import bz2
+import gzip
+import io
+import json
+import lzma
+import struct
+from abc import ABC, abstractmethod
+
+
+# Serializers of intermediate data (map partitions, spilled runs and shuffle payloads).
+# Data is a stream of (key, value) tuples which can be written and read record by record.
+class Serializer(ABC):
+    name = None
+
+    @abstractmethod
+    def write(self, f, tuples):
+        pass
+
+    @abstractmethod
+    def read(self, f):
+        pass
+
+    def dump(self, tuples, path):
+        with open(path, 'wb') as f:
+            self.write(f, tuples)
+
+    # lazily read tuples of a file written by dump
+    def load(self, path):
+        with open(path, 'rb') as f:
+            yield from self.read(f)
+
+    def dumps(self, tuples):
+        f = io.BytesIO()
+        self.write(f, tuples)
+        return f.getvalue()
+
+    def loads(self, data):
+        return self.read(io.BytesIO(data))
+
+
+# one json record per line, tuple keys are turned to lists
+class JsonSerializer(Serializer):
+    name = "json"
+
+    def write(self, f, tuples):
+        for t in tuples:
+            f.write(json.dumps(t).encode('utf-8'))
+            f.write(b"\n")
+
+    def read(self, f):
+        for line in f:
+            t = json.loads(line.decode('utf-8'))
+            yield t[0], t[1]
+
+
+_size = struct.Struct(">I")
+_int = struct.Struct(">q")
+_float = struct.Struct(">d")
+
+
+# Tagged encoding of values: a type tag byte followed by the value, containers are
+# prefixed by the number of items. Unlike pickle, decoding data of other workers
+# can only build values of these types and never runs code.
+def _encode(value, out):
+    t = type(value)
+    if t is str:
+        b = value.encode('utf-8', 'surrogatepass')
+        out += b"s" + _size.pack(len(b)) + b
+    elif t is int:
+        if -(1 << 63) <= value < (1 << 63):
+            out += b"i" + _int.pack(value)
+        else:
+            b = value.to_bytes((value.bit_length() + 8) // 8, 'big', signed=True)
+            out += b"I" + _size.pack(len(b)) + b
+    elif t is float:
+        out += b"f" + _float.pack(value)
+    elif t is tuple or t is list:
+        out += (b"t" if t is tuple else b"l") + _size.pack(len(value))
+        for v in value:
+            _encode(v, out)
+    elif t is bool:
+        out += b"T" if value else b"F"
+    elif value is None:
+        out += b"N"
+    elif t is bytes:
+        out += b"b" + _size.pack(len(value)) + value
+    elif t is dict:
+        out += b"d" + _size.pack(len(value))
+        for k, v in value.items():
+            _encode(k, out)
+            _encode(v, out)
+    else:
+        raise TypeError("Unsupported type of intermediate data: " + t.__name__)
+
+
+# Return (value, position after the value)
+def _decode(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == 0x73:  # s
+        n = _size.unpack_from(data, pos)[0]
+        pos += 4
+        return bytes(data[pos:pos + n]).decode('utf-8', 'surrogatepass'), pos + n
+    if tag == 0x69:  # i
+        return _int.unpack_from(data, pos)[0], pos + 8
+    if tag == 0x66:  # f
+        return _float.unpack_from(data, pos)[0], pos + 8
+    if tag == 0x74 or tag == 0x6c:  # t, l
+        n = _size.unpack_from(data, pos)[0]
+        pos += 4
+        items = []
+        for _ in range(n):
+            v, pos = _decode(data, pos)
+            items.append(v)
+        return (tuple(items) if tag == 0x74 else items), pos
+    if tag == 0x54:  # T
+        return True, pos
+    if tag == 0x46:  # F
+        return False, pos
+    if tag == 0x4e:  # N
+        return None, pos
+    if tag == 0x62 or tag == 0x49:  # b, I
+        n = _size.unpack_from(data, pos)[0]
+        pos += 4
+        b = bytes(data[pos:pos + n])
+        return (b if tag == 0x62 else int.from_bytes(b, 'big', signed=True)), pos + n
+    if tag == 0x64:  # d
+        n = _size.unpack_from(data, pos)[0]
+        pos += 4
+        d = {}
+        for _ in range(n):
+            k, pos = _decode(data, pos)
+            d[k], pos = _decode(data, pos)
+        return d, pos
+    raise ValueError("Unknown type tag " + str(tag) + " in intermediate data")
+
+
+# length-prefixed binary records: 4 bytes of record size followed by the tagged encoding of the tuple,
+# types of keys and values (str, int, float, bool, None, bytes, tuples, lists and dicts of them) are preserved
+class BinarySerializer(Serializer):
+    name = "binary"
+
+    def write(self, f, tuples):
+        for t in tuples:
+            record = bytearray()
+            _encode(t[0], record)
+            _encode(t[1], record)
+            f.write(_size.pack(len(record)))
+            f.write(record)
+
+    def read(self, f):
+        while True:
+            h = f.read(4)
+            if len(h) < 4:
+                return
+            n = _size.unpack(h)[0]
+            record = f.read(n)
+            if len(record) < n:
+                raise ValueError("Truncated record of intermediate data")
+            key, pos = _decode(record, 0)
+            value, pos = _decode(record, pos)
+            if pos != n:
+                raise ValueError("Malformed record of intermediate data")
+            yield key, value
+
+
+serializers = {
+    JsonSerializer.name: JsonSerializer,
+    BinarySerializer.name: BinarySerializer,
+}
+
+
+# Codecs of intermediate files, shuffle payloads and results of a job.
+# open wraps a binary file into a compressed stream, compress and decompress work on whole payloads.
+class Codec(ABC):
+    name = None
+    default_level = None
+
+    def __init__(self, level=None):
+        self.level = self.default_level if level is None else level
+
+    @abstractmethod
+    def open(self, f, mode):
+        pass
+
+    @abstractmethod
+    def compress(self, data):
+        pass
+
+    @abstractmethod
+    def decompress(self, data):
+        pass
+
+
+# deflate of zlib in gzip framing, so that streams and payloads have the same format
+class ZlibCodec(Codec):
+    name = "zlib"
+    default_level = 6
+
+    def open(self, f, mode):
+        return gzip.GzipFile(fileobj=f, mode=mode, compresslevel=self.level)
+
+    def compress(self, data):
+        return gzip.compress(data, self.level)
+
+    def decompress(self, data):
+        return gzip.decompress(data)
+
+
+class LzmaCodec(Codec):
+    name = "lzma"
+    default_level = 6
+
+    def open(self, f, mode):
+        return lzma.LZMAFile(f, mode, preset=self.level if 'w' in mode else None)
+
+    def compress(self, data):
+        return lzma.compress(data, preset=self.level)
+
+    def decompress(self, data):
+        return lzma.decompress(data)
+
+
+class Bz2Codec(Codec):
+    name = "bz2"
+    default_level = 9
+
+    def open(self, f, mode):
+        return bz2.BZ2File(f, mode, compresslevel=self.level)
+
+    def compress(self, data):
+        return bz2.compress(data, self.level)
+
+    def decompress(self, data):
+        return bz2.decompress(data)
+
+
+codecs = {
+    ZlibCodec.name: ZlibCodec,
+    LzmaCodec.name: LzmaCodec,
+    Bz2Codec.name: Bz2Codec,
+}
+
+
+# codec by spec <name>[:<level>], e.g. zlib:9, None if spec is empty
+def get_codec(spec):
+    if not spec:
+        return None
+    name, _, level = spec.partition(":")
+    if name not in codecs:
+        raise ValueError("Unknown codec " + str(spec))
+    return codecs[name](int(level) if level else None)
+
+
+# buffers small writes of a serializer before they reach the compressor and counts uncompressed bytes
+class _CountingWriter:
+    def __init__(self, f, size=1 << 16):
+        self.f = f
+        self.size = size
+        self.buf = bytearray()
+        self.count = 0
+
+    def write(self, data):
+        self.buf += data
+        self.count += len(data)
+        if len(self.buf) >= self.size:
+            self.flush()
+
+    def flush(self):
+        self.f.write(self.buf)
+        self.buf = bytearray()
+
+
+# serializer whose records are compressed by codec, named <serializer>+<codec>
+# so that readers of a file or payload know how to decode it
+# raw_bytes and stored_bytes - sizes of data written by this instance before and after compression
+class CompressedSerializer(Serializer):
+    def __init__(self, serializer, codec):
+        self.serializer = serializer
+        self.codec = codec
+        self.name = serializer.name + "+" + codec.name
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    def write(self, f, tuples):
+        start = f.tell()
+        with self.codec.open(f, 'wb') as z:
+            w = _CountingWriter(z)
+            self.serializer.write(w, tuples)
+            w.flush()
+        self.raw_bytes += w.count
+        self.stored_bytes += f.tell() - start
+
+    def read(self, f):
+        with self.codec.open(f, 'rb') as z:
+            yield from self.serializer.read(z)
+
+
+# Return dict {raw: bytes before compression, stored: bytes written} or None if the serializer does not compress
+def compression_stats(serializer):
+    if not isinstance(serializer, CompressedSerializer):
+        return None
+    return {'raw': serializer.raw_bytes, 'stored': serializer.stored_bytes}
+
+
+# serializer compressed with the codec of a job, serializer itself if the job has no codec
+# codec - spec of codec, see get_codec
+def compressed(serializer, codec):
+    c = get_codec(codec)
+    if c is None:
+        return serializer
+    return CompressedSerializer(serializer, c)
+
+
+# name - name of serializer, optionally followed by +<codec name>
+def get_serializer(name):
+    name, _, codec = str(name).partition("+")
+    if name not in serializers:
+        raise ValueError("Unknown intermediate format " + str(name))
+    return compressed(serializers[name](), codec)
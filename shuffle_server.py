@@ -0,0 +1,126 @@
+import json
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from enums import MapStatus
+
+range_re = re.compile(r"bytes=(\d*)-(\d*)")
+
+# map output is available only when all region files of a chunk are written
+mapped_statuses = (MapStatus.partitions_saved, MapStatus.finished)
+
+
+# HTTP endpoint which streams map output from work dir of the mapper:
+# GET /task_id/region - json {format: serializer name, chunks: list of mapped chunk paths}
+# GET /task_id/region?chunk=path - region file of the chunk, Range header is supported
+class ShuffleHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections alive between requests of reducer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 2:
+            self.send_error(400)
+            return
+
+        task_id, region = parts
+        chunks = parse_qs(url.query).get("chunk")
+        if chunks is None:
+            self._send_index(task_id)
+        else:
+            self._send_region(task_id, chunks[0], region)
+
+    def _mapped_chunks(self, task_id):
+        tasks = self.server.mapper.tasks.get(task_id, {})
+        return [path for path, t in list(tasks.items()) if t.status in mapped_statuses]
+
+    def _send_index(self, task_id):
+        mapper = self.server.mapper
+        chunks = self._mapped_chunks(task_id)
+        body = json.dumps({'format': mapper.task_serializer(task_id).name, 'chunks': chunks}).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_region(self, task_id, chunk_path, region):
+        if chunk_path not in self._mapped_chunks(task_id) or not region.isdigit():
+            self.send_error(404)
+            return
+
+        path = self.server.mapper._get_chunk_dir_path(task_id, chunk_path) + "/" + region
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            start, end = 0, size - 1
+
+            m = range_re.match(self.headers.get("Range", ""))
+            if m is not None and size > 0:
+                if m.group(1):
+                    start = int(m.group(1))
+                    if m.group(2):
+                        end = min(int(m.group(2)), end)
+                elif m.group(2):
+                    start = max(size - int(m.group(2)), 0)
+
+                if start > end:
+                    self.send_response(416)
+                    self.send_header("Content-Range", "bytes */" + str(size))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                self.send_response(206)
+                self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, size))
+            else:
+                self.send_response(200)
+
+            length = end - start + 1
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(length))
+            self.end_headers()
+            self._send_file(f, start, length)
+
+    # stream file with sendfile if possible, without copying data to python
+    def _send_file(self, f, offset, count):
+        self.wfile.flush()
+        try:
+            while count > 0:
+                sent = os.sendfile(self.connection.fileno(), f.fileno(), offset, count)
+                if sent == 0:
+                    break
+                offset += sent
+                count -= sent
+        except (AttributeError, OSError):
+            f.seek(offset)
+            while count > 0:
+                data = f.read(min(count, 1 << 20))
+                if not data:
+                    break
+                self.wfile.write(data)
+                count -= len(data)
+
+
+class ShuffleServer:
+    def __init__(self, mapper, host, port):
+        self.server = ThreadingHTTPServer((host, port), ShuffleHandler)
+        self.server.daemon_threads = True
+        self.server.mapper = mapper
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,89 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+# Executor of map and reduce tasks of a worker with bounded number of slots.
+# Each task occupies a map or reduce slot from submission till it is finished,
+# tasks above the limit wait in a queue.
+# With process isolation user scripts are executed in a pool of processes,
+# so CPU bound scripts are not serialized by GIL of the worker.
+class SlotExecutor:
+    def __init__(self, map_slots, reduce_slots, isolation="process"):
+        if isolation not in ("process", "thread"):
+            raise ValueError("Unknown isolation " + str(isolation))
+
+        self.map_slots = map_slots
+        self.reduce_slots = reduce_slots
+        self.isolation = isolation
+        self.map_pool = ThreadPoolExecutor(max_workers=map_slots)
+        self.reduce_pool = ThreadPoolExecutor(max_workers=reduce_slots)
+        self.processes = None
+        self.running_maps = 0  # submitted map tasks which are not finished
+        self.running_reduces = 0
+        self.lock = threading.Lock()
+        self.on_free = None  # called when a task is finished and its slot is free
+
+    @staticmethod
+    def from_opts(opts):
+        cpus = os.cpu_count() or 1
+        return SlotExecutor(int(opts.get("map_slots", cpus)), int(opts.get("reduce_slots", cpus)),
+                            opts.get("isolation", "process"))
+
+    @property
+    def free_map_slots(self):
+        return max(0, self.map_slots - self.running_maps)
+
+    @property
+    def free_reduce_slots(self):
+        return max(0, self.reduce_slots - self.running_reduces)
+
+    def submit_map(self, fn, *args):
+        return self._submit(self.map_pool, "running_maps", fn, args)
+
+    def submit_reduce(self, fn, *args):
+        return self._submit(self.reduce_pool, "running_reduces", fn, args)
+
+    def _submit(self, pool, counter, fn, args):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        return pool.submit(self._occupy, counter, fn, args)
+
+    def _occupy(self, counter, fn, args):
+        try:
+            return fn(*args)
+        finally:
+            with self.lock:
+                setattr(self, counter, getattr(self, counter) - 1)
+            if self.on_free is not None:
+                self.on_free()
+
+    # execute function of user script and wait for its result,
+    # fn and args have to be picklable in case of process isolation
+    # if a script kills its process, BrokenProcessPool is raised and the pool is replaced for next tasks
+    def run(self, fn, *args):
+        if self.isolation == "thread":
+            return fn(*args)
+
+        with self.lock:
+            if self.processes is None:
+                ctx = multiprocessing.get_context("spawn")
+                self.processes = ProcessPoolExecutor(max_workers=self.map_slots + self.reduce_slots, mp_context=ctx)
+            processes = self.processes
+
+        try:
+            return processes.submit(fn, *args).result()
+        except BrokenProcessPool:
+            with self.lock:
+                if self.processes is processes:
+                    self.processes = None
+            processes.shutdown(wait=False)
+            raise
+
+    def shutdown(self):
+        self.map_pool.shutdown()
+        self.reduce_pool.shutdown()
+        if self.processes is not None:
+            self.processes.shutdown()
@@ -0,0 +1,66 @@
+import unittest
+import tempfile
+from aggregation import aggregations, get_aggregation, HashAggregator, AggregateCombiner, reduce_partials
+from collector import OutputCollector
+from hash_partitioner import HashPartitioner
+from serialization import JsonSerializer
+from local_runner import LocalRunner
+
+
+class Script:
+    def __init__(self, name):
+        self.Aggregate = name
+
+
+class TestAggregation(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    # map tuples by two mappers with a small dict and reduce their partials
+    def run_job(self, name, tuples):
+        aggregation = get_aggregation(Script(name))
+        streams = []
+        for i, part in enumerate([tuples[::2], tuples[1::2]]):
+            collector = OutputCollector(1, HashPartitioner(), JsonSerializer(), self.dir.name + "/spill" + str(i),
+                                        2, AggregateCombiner(aggregation))
+            aggregator = HashAggregator(aggregation, collector, 2)
+            for key, value in part:
+                aggregator.emit(key, value)
+            aggregator.save(self.dir.name + "/map" + str(i))
+            streams.append(JsonSerializer().load(self.dir.name + "/map" + str(i) + "/1"))
+        return reduce_partials(aggregation, streams)
+
+    def test_aggregations(self):
+        tuples = [("b", 2), ("a", 1), ("c", 5), ("a", 3), ("b", 2), ("a", 3)]
+        expected = {
+            "sum": [("a", 7), ("b", 4), ("c", 5)],
+            "count": [("a", 3), ("b", 2), ("c", 1)],
+            "min": [("a", 1), ("b", 2), ("c", 5)],
+            "max": [("a", 3), ("b", 2), ("c", 5)],
+            "mean": [("a", 7 / 3), ("b", 2.0), ("c", 5.0)],
+            "distinct": [("a", 2), ("b", 1), ("c", 1)],
+        }
+        self.assertSetEqual(set(aggregations), set(expected))
+        for name, e in expected.items():
+            self.assertListEqual(e, self.run_job(name, tuples), name)
+
+    def test_distinct_values_from_json(self):
+        tuples = [("k", (1, 2)), ("k", [1, 2]), ("k", (3, 4)), ("k", (1, 2))]
+        self.assertListEqual([("k", 2)], self.run_job("distinct", tuples))
+
+    def test_unknown_aggregation(self):
+        self.assertIsNone(get_aggregation(object()))
+        self.assertRaises(ValueError, get_aggregation, Script("median"))
+
+    def test_max_year_temp(self):
+        with open(self.dir.name + "/t.txt", "w") as f:
+            f.write("[[201501, 31.2], [201307, 32], [201502, 40], [201302, -4]]")
+        runner = LocalRunner("map_libs/max_year_temp.py", rds_count=2, processes=1)
+        self.assertListEqual([(2013, 32), (2015, 40)], sorted(runner.run(self.dir.name)))
+
+
+if __name__ == '__main__':
+    unittest.main()
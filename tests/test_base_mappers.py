@@ -1,6 +1,7 @@
 import unittest
 from map_libs.word_count import Mapper
 import map_libs.max_year_temp
+from aggregation import get_aggregation, reduce_partials
 
 
 class TestMappers(unittest.TestCase):
@@ -50,10 +51,10 @@ class TestMappers(unittest.TestCase):
         self.assertListEqual(exp, r)
 
     def test_max_temp_reducer(self):
-        m = map_libs.max_year_temp.Reducer()
+        aggregation = get_aggregation(map_libs.max_year_temp)
 
         data = [(2015, 31.2), (2015, 41), (2016, 11)]
-        r = m.run_reduce(data)
+        r = reduce_partials(aggregation, [data])
         exp = [(2015, 41), (2016, 11)]
         self.assertListEqual(exp, r)
 
@@ -0,0 +1,71 @@
+import unittest
+import tempfile
+import random
+from collector import OutputCollector
+from hash_partitioner import HashPartitioner
+from total_order_partitioner import TotalOrderPartitioner
+from serialization import BinarySerializer
+from local_runner import LocalRunner
+
+try:
+    import numpy as np
+    from batch import sorted_blocks, reduce_sorted
+    import map_libs.max_year_temp_batch as max_temp
+except ImportError:
+    np = None
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_regions_are_sorted(self):
+        keys = np.array([random.randrange(100) for _ in range(1000)])
+        values = np.ones(len(keys), dtype=np.int64)
+        collector = OutputCollector(3, HashPartitioner(), BinarySerializer(), self.dir.name + "/spill")
+        collector.emit_batch(keys, values)
+        collector.emit_batch(keys[:10], values[:10])
+
+        regions = [list(collector.merge(region)) for region in (1, 2, 3)]
+        self.assertEqual(1010, sum(len(r) for r in regions))
+        for r in regions:
+            self.assertListEqual(sorted(r), r)
+        # every key is in one region
+        region_keys = [set(k for k, _ in r) for r in regions]
+        self.assertEqual(len(set(keys.tolist())), sum(len(k) for k in region_keys))
+
+    # the same key goes to one region from batches of any dtype and from per-record emit
+    def test_hash_partitions_match_per_record(self):
+        for p in (HashPartitioner(), HashPartitioner("crc32")):
+            ints = np.array([1, 2015, -7, 123456789])
+            expected = [p.get_partition(k, 1, 5) for k in ints.tolist()]
+            self.assertListEqual(expected, p.partition_array(ints, 5).tolist())
+            self.assertListEqual(expected, p.partition_array(ints.astype(np.float64), 5).tolist())
+            words = np.array(["aa", "bb", "aa"])
+            self.assertListEqual([p.get_partition(k, 1, 3) for k in words.tolist()],
+                                 p.partition_array(words, 3).tolist())
+
+    def test_total_order_partitions(self):
+        p = TotalOrderPartitioner([10, 20])
+        keys = np.array([5, 10, 15, 25])
+        self.assertListEqual([p.get_partition(k, 1, 3) for k in keys.tolist()], p.partition_array(keys, 3).tolist())
+
+    def test_key_is_not_split_between_blocks(self):
+        tuples = [(1, 1.0), (1, 2.0), (2, 3.0), (2, 1.0), (2, 4.0), (3, 0.0)]
+        blocks = [k.tolist() for k, _ in sorted_blocks(tuples, 2)]
+        self.assertListEqual([[1, 1], [2, 2, 2], [3]], blocks)
+        self.assertListEqual([(1, 2.0), (2, 4.0), (3, 0.0)], reduce_sorted(max_temp.Reducer(), tuples, 2))
+
+    def test_max_temp(self):
+        with open(self.dir.name + "/t.txt", "w") as f:
+            f.write("201501 31.2\n201307 32\n201302 31.2\n201501 -4\n201002 20\n" * 20)
+        runner = LocalRunner("map_libs/max_year_temp_batch.py", rds_count=2, processes=1, chunk_size=64)
+        self.assertListEqual([(2010, 20.0), (2013, 32.0), (2015, 31.2)], sorted(runner.run(self.dir.name)))
+
+
+if __name__ == '__main__':
+    unittest.main()
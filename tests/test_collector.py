@@ -0,0 +1,58 @@
+import unittest
+import tempfile
+from collector import OutputCollector
+from serialization import BinarySerializer
+from hash_partitioner import HashPartitioner
+import map_libs.word_count
+
+
+class TestCollector(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def create_collector(self, rds_count, buffer_size, combiner=None):
+        return OutputCollector(rds_count, HashPartitioner(), BinarySerializer(), self.dir.name + "/spill", buffer_size, combiner)
+
+    def test_partition_on_emit(self):
+        c = self.create_collector(2, 100)
+        for k in ['mm', 'cc', 'bb', 'aa', 'mm']:
+            c.emit(k, 1)
+
+        self.assertEqual(5, c.count)
+        self.assertListEqual([('bb', 1)], list(c.merge(1)))
+        self.assertListEqual([('aa', 1), ('cc', 1), ('mm', 1), ('mm', 1)], list(c.merge(2)))
+
+    def test_partition_in_batches(self):
+        partitioner = HashPartitioner()
+        batches = []
+        partition_batch = partitioner.partition_batch
+        partitioner.partition_batch = lambda keys, n: batches.append(len(keys)) or partition_batch(keys, n)
+        c = OutputCollector(2, partitioner, BinarySerializer(), self.dir.name + "/spill", 3)
+        for k in ['mm', 'cc', 'bb', 'aa', 'mm']:
+            c.emit(k, 1)
+
+        self.assertListEqual([('bb', 1)], list(c.merge(1)))
+        self.assertListEqual([3, 2], batches)
+
+    def test_spill_and_merge(self):
+        c = self.create_collector(1, 2)
+        for k in ['dd', 'aa', 'cc', 'bb', 'aa']:
+            c.emit(k, 1)
+
+        self.assertEqual(2, len(c.runs[1]))
+        self.assertListEqual([('aa', 1), ('aa', 1), ('bb', 1), ('cc', 1), ('dd', 1)], list(c.merge(1)))
+
+    def test_combine_spilled_runs(self):
+        c = self.create_collector(1, 2, map_libs.word_count.Combiner())
+        for k in ['aa', 'bb', 'aa', 'aa', 'bb']:
+            c.emit(k, 1)
+
+        c.save(self.dir.name + "/out")
+        self.assertListEqual([('aa', 3), ('bb', 2)], list(BinarySerializer().load(self.dir.name + "/out/1")))
+
+
+if __name__ == '__main__':
+    unittest.main()
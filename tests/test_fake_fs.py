@@ -0,0 +1,61 @@
+import unittest
+import os
+import tempfile
+import cfg
+from enums import Status
+from fake_fs import FakeFS
+
+
+class TestFakeFS(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.fs = FakeFS(self.dir.name, 4)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_ranged_read(self):
+        self.fs.save("abc\ndef", "/f")
+        self.assertEqual("abc\ndef", self.fs.get_chunk("/f")['data'])
+        self.assertEqual("c\nd", self.fs.get_chunk("/f", 2, 3)['data'])
+        self.assertEqual("", self.fs.get_chunk("/f", 10)['data'])
+        self.assertEqual(Status.not_found, self.fs.get_chunk("/none")['status'])
+
+    def test_binary_data_round_trip(self):
+        self.fs.save(b"\x00\xff\xfe\n", "/bin")
+        self.fs.save(self.fs.get_chunk("/bin")['data'], "/copy")
+        with open(self.dir.name + "/copy", 'rb') as f:
+            self.assertEqual(b"\x00\xff\xfe\n", f.read())
+
+    def test_upload_in_chunks(self):
+        local_path = os.path.join(self.dir.name, "in.txt")
+        with open(local_path, 'w') as f:
+            f.write("0123456789")
+        self.fs.create_file(local_path, "/up")
+
+        chunks = self.fs.path_status("/up/in.txt")['chunks']
+        self.assertListEqual(["/up/in.txt_0", "/up/in.txt_1", "/up/in.txt_2"], list(chunks))
+        self.assertEqual("89", self.fs.get_chunk("/up/in.txt_2")['data'])
+        self.assertEqual((Status.ok, "0123456789"), self.fs.get_file_content("/up/in.txt"))
+
+        self.fs.download_to("/up/in.txt", os.path.join(self.dir.name, "out/in.txt"))
+        with open(os.path.join(self.dir.name, "out/in.txt")) as f:
+            self.assertEqual("0123456789", f.read())
+
+    def test_chunks_keep_multibyte_characters(self):
+        local_path = os.path.join(self.dir.name, "utf.txt")
+        with open(local_path, 'w', encoding='utf-8') as f:
+            f.write("abcмир€")
+        self.fs.create_file(local_path, "/up")
+
+        chunks = [self.fs.get_chunk(path)['data'] for path in self.fs.path_status("/up/utf.txt")['chunks']]
+        self.assertListEqual(["abc", "ми", "р", "€"], chunks)
+
+    def test_backend_by_config(self):
+        fs = cfg.create_fs({"fs": "local", "fs_dir": self.dir.name})
+        self.assertIsInstance(fs, FakeFS)
+        self.assertEqual(self.dir.name, fs.base_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
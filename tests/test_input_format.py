@@ -0,0 +1,52 @@
+import unittest
+from enums import Status
+from input_format import Split, TextLines, JsonLines, FixedWidth, get_input_format, read_split
+
+
+# DFS which knows chunks of files
+class ChunksFS:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def get_chunk(self, chunk_path):
+        if chunk_path not in self.chunks:
+            return {'status': Status.not_found}
+        return {'status': Status.ok, 'data': self.chunks[chunk_path]}
+
+
+# split every chunk of the file and return records of all chunks
+def read_file(input_format, chunks):
+    fs = ChunksFS({"/f_" + str(i): data for i, data in enumerate(chunks)})
+    records = []
+    for i, data in enumerate(chunks):
+        records += list(input_format.records(read_split(fs, input_format, "/f_" + str(i), data)))
+    return records
+
+
+class TestInputFormat(unittest.TestCase):
+    def test_lines_across_chunks(self):
+        lines = read_file(TextLines(), ["ab\ncd", "e\nf", "ghijk", "lm\n", "n\n"])
+        self.assertListEqual(["ab", "cde", "fghijklm", "n"], lines)
+
+    def test_line_starting_at_chunk(self):
+        self.assertListEqual(["ab", "cd", ""], read_file(TextLines(), ["ab\n", "cd\n", ""]))
+        self.assertListEqual(["a b"], list(TextLines().records(Split("a b"))))
+
+    def test_json_lines(self):
+        records = read_file(JsonLines(), ['{"a": 1}\n{"b"', ': [1, 2]}\n\n'])
+        self.assertListEqual([{"a": 1}, {"b": [1, 2]}], records)
+
+    def test_fixed_width(self):
+        records = read_file(FixedWidth(3, 4), ["abcd", "efgh", "ij"])
+        self.assertListEqual(["abc", "def", "ghi", "j"], records)
+        self.assertListEqual(["ab", "cd"], read_file(FixedWidth(2), ["ab", "cd"]))
+
+    def test_format_by_name(self):
+        self.assertIsInstance(get_input_format("json_lines"), JsonLines)
+        fixed = get_input_format("fixed:8:64")
+        self.assertEqual((8, 64), (fixed.record_size, fixed.chunk_size))
+        self.assertRaises(ValueError, get_input_format, "csv")
+
+
+if __name__ == '__main__':
+    unittest.main()
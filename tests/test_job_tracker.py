@@ -0,0 +1,339 @@
+import unittest
+import os
+import json
+import time
+import tempfile
+import threading
+from datetime import timedelta
+from job_tracker import JobTracker
+from enums import Status, TaskStatus, MapStatus, ReduceStatus
+
+
+# DFS which knows only chunks of inputs
+class FakeDFS:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def path_status(self, path):
+        return {'status': Status.ok, 'chunks': self.chunks}
+
+
+class TestJobTracker(unittest.TestCase):
+    def setUp(self):
+        chunks = {"/in/" + str(i): "http://10.0.0.1:8888" for i in range(4)}
+        self.jt = JobTracker(dump_on=False, dfs=FakeDFS(chunks))
+        self.workers = ["http://10.0.1.1:8888", "http://10.0.1.2:8888", "http://10.0.1.3:8888"]
+        for w in self.workers:
+            self.beat(w, 0)
+
+    # Return list of (task_id, chunk path or region) assigned to the worker
+    def beat(self, worker, maps=1, reduces=0, progress=None):
+        r = self.jt.heartbeat(worker, {'map': maps, 'reduce': reduces}, progress)
+        return [(a['task_id'], a.get('chunk_path', a.get('region'))) for a in r['assignments']]
+
+    # Return task_id, task and list of (worker, chunk path) of the first heartbeats
+    def start_task(self):
+        task_id = self.jt.create_task("/in", "/script.py")
+        assignments = [(w, path) for w in self.workers for _, path in self.beat(w)]
+        return task_id, self.jt.tasks[task_id], assignments
+
+    def test_backup_of_straggling_map(self):
+        task_id, task, assignments = self.start_task()
+        self.assertEqual(3, len(assignments))
+        for worker, path in assignments[1:]:
+            self.jt.mapping_done(worker, task_id, path)
+        for _, path in self.beat(assignments[1][0]):
+            self.jt.mapping_done(assignments[1][0], task_id, path)
+
+        straggler = task.get_chunk(assignments[0][1])
+        straggler.started -= 10
+        self.assertListEqual([], self.beat(assignments[0][0]))
+        self.assertListEqual([(task_id, straggler.path)], self.beat(assignments[1][0]))
+        self.assertEqual(2, len(straggler.attempts))
+
+    def test_first_attempt_wins(self):
+        task_id, task, assignments = self.start_task()
+        chunk = task.get_chunk(assignments[0][1])
+        chunk.attempts.append(self.workers[2])
+
+        self.assertTrue(task.complete_chunk_from_worker(chunk.path, self.workers[2]))
+        self.assertFalse(task.complete_chunk_from_worker(chunk.path, assignments[0][0]))
+        self.assertEqual(self.workers[2], chunk.mapper)
+
+    def test_loser_death_keeps_completed_chunk(self):
+        task_id, task, assignments = self.start_task()
+        loser, chunk = assignments[0][0], task.get_chunk(assignments[0][1])
+        winner = self.workers[2] if loser != self.workers[2] else self.workers[1]
+        chunk.attempts.append(winner)
+        task.complete_chunk_from_worker(chunk.path, winner)
+
+        task.reset_chunk_from_worker(loser)
+        self.assertEqual(MapStatus.map_applied, chunk.status)
+
+        task.reset_chunk_from_worker(winner)
+        self.assertEqual(MapStatus.accepted, chunk.status)
+
+    def test_result_of_first_reduce_attempt(self):
+        task_id, task, _ = self.start_task()
+        task.create_regions()
+        task.status = TaskStatus.reducing
+        for region in task.regions.values():
+            region.started = time.time()
+
+        self.jt.reducing_done(self.workers[0], task_id, 1, "/r/1_a")
+        self.jt.reducing_done(self.workers[1], task_id, 1, "/r/1_b")
+        self.assertEqual(ReduceStatus.finished, task.regions[1].status)
+        self.assertEqual("/r/1_a", self.jt.get_result(task_id)[0])
+
+    def test_assign_free_slots(self):
+        self.jt.create_task("/in", "/script.py")
+        self.assertEqual(2, len(self.beat(self.workers[0], 2)))
+        self.assertListEqual([], self.beat(self.workers[0], 0))
+        self.assertEqual(2, len(self.beat(self.workers[1], 3)))
+
+    def test_reduce_in_reduce_slots(self):
+        task_id, task, assignments = self.start_task()
+        self.assertListEqual([], self.beat(self.workers[0], 0, 3))
+        assignments += [(self.workers[0], path) for _, path in self.beat(self.workers[0])]
+        for worker, path in assignments:
+            self.jt.mapping_done(worker, task_id, path)
+
+        self.assertListEqual([], self.beat(self.workers[0], 3, 0))
+        self.assertListEqual([(task_id, 1), (task_id, 2)], self.beat(self.workers[0], 0, 2))
+
+    def test_reducers_start_after_slowstart(self):
+        self.jt.reduce_slowstart = 0.5
+        task_id, task, assignments = self.start_task()
+        self.jt.mapping_done(assignments[0][0], task_id, assignments[0][1])
+        self.assertListEqual([], self.beat(self.workers[0], 0, 1))
+
+        self.jt.mapping_done(assignments[1][0], task_id, assignments[1][1])
+        r = self.jt.heartbeat(self.workers[0], {'map': 0, 'reduce': 1}, [])
+        self.assertEqual(TaskStatus.mapping, task.status)
+        self.assertEqual(1, r['assignments'][0]['region'])
+        self.assertFalse(r['assignments'][0]['maps_done'])
+        self.assertListEqual([[w, [p]] for w, p in assignments[:2]], r['assignments'][0]['mappers'])
+
+        self.jt.mapping_done(assignments[2][0], task_id, assignments[2][1])
+        progress = [{'kind': 'reduce', 'task_id': task_id, 'item': 1, 'status': ReduceStatus.start_data_loading}]
+        outputs = self.jt.heartbeat(self.workers[0], {'map': 0, 'reduce': 0}, progress)['map_outputs']
+        self.assertListEqual([[w, [p]] for w, p in assignments], outputs[0]['mappers'])
+        self.assertFalse(outputs[0]['maps_done'])
+
+    def test_failed_map_is_retried(self):
+        task_id, task, assignments = self.start_task()
+        worker, path = assignments[0]
+        for i in range(self.jt.max_failures - 1):
+            self.jt.mapping_failed(worker, task_id, path)
+            self.assertEqual(MapStatus.accepted, task.get_chunk(path).status)
+            self.assertIn((task_id, path), self.beat(worker, 2))
+
+        self.jt.mapping_failed(worker, task_id, path)
+        self.assertEqual(TaskStatus.failed, task.status)
+
+    def test_lost_attempt_is_reset(self):
+        task_id, task, assignments = self.start_task()
+        worker, path = assignments[0]
+        progress = [{'kind': 'map', 'task_id': task_id, 'item': path, 'status': MapStatus.chunk_loaded}]
+        self.beat(worker, 0, 0, progress)
+        self.assertEqual(MapStatus.chunk_loaded, task.get_chunk(path).status)
+
+        self.beat(worker, 0, 0, [])
+        self.assertEqual(MapStatus.accepted, task.get_chunk(path).status)
+        self.assertEqual(1, task.get_chunk(path).failures)
+
+    def test_lost_map_output_after_mapping(self):
+        task_id, task, assignments = self.start_task()
+        for worker, path in assignments:
+            self.jt.mapping_done(worker, task_id, path)
+        for _, path in self.beat(self.workers[0]):
+            self.jt.mapping_done(self.workers[0], task_id, path)
+        self.assertEqual(TaskStatus.reducing, task.status)
+
+        dead = assignments[1][0]
+        self.jt.workers[dead].last_heartbeat -= timedelta(seconds=self.jt.worker_timeout + 1)
+        with self.jt.lock:
+            self.jt._remove_dead_workers()
+        self.assertEqual(TaskStatus.mapping, task.status)
+        self.assertEqual(MapStatus.accepted, task.get_chunk(assignments[1][1]).status)
+
+        lost = self.beat(self.workers[0])
+        self.assertListEqual([(task_id, assignments[1][1])], lost)
+        self.jt.mapping_done(self.workers[0], task_id, lost[0][1])
+        self.assertEqual(TaskStatus.reducing, task.status)
+
+    def test_wait_status_wakes_on_change(self):
+        task_id, task, assignments = self.start_task()
+
+        def complete():
+            for worker, path in assignments:
+                self.jt.mapping_done(worker, task_id, path)
+            for _, path in self.beat(self.workers[0]):
+                self.jt.mapping_done(self.workers[0], task_id, path)
+        threading.Timer(0.1, complete).start()
+
+        started = time.time()
+        self.assertEqual(TaskStatus.reducing, self.jt.wait_status(task_id, TaskStatus.mapping, 5))
+        self.assertLess(time.time() - started, 2)
+
+    def test_wait_result_wakes_on_reduced_region(self):
+        task_id, task, _ = self.start_task()
+        task.create_regions()
+        task.status = TaskStatus.reducing
+        threading.Timer(0.1, self.jt.reducing_done, (self.workers[0], task_id, 2, "/r/2")).start()
+
+        r = self.jt.wait_result(task_id, 0, 5)
+        self.assertEqual(TaskStatus.reducing, r['status'])
+        self.assertListEqual(["", "/r/2", ""], r['result'])
+
+    def test_compressed_bytes_of_completed_maps(self):
+        task_id = self.jt.create_task("/in", "/script.py", False, 1, "", "zlib:9")
+        assignments = [(w, a) for w in self.workers for a in self.jt.heartbeat(w, {'map': 1, 'reduce': 0})['assignments']]
+        self.assertEqual("zlib:9", assignments[0][1]['codec'])
+
+        worker, a = assignments[0]
+        self.jt.mapping_done(worker, task_id, a['chunk_path'], {'raw': 100, 'stored': 20})
+        self.jt.mapping_done(worker, task_id, a['chunk_path'], {'raw': 100, 'stored': 20})
+        r = self.jt.get_compression(task_id)
+        self.assertEqual((100, 20, 80), (r['map_raw'], r['map_stored'], r['saved']))
+        self.assertRaises(ValueError, self.jt.create_task, "/in", "/script.py", False, 1, "", "zip")
+
+    def test_metrics_of_completed_attempts(self):
+        task_id, task, assignments = self.start_task()
+        worker, path = assignments[0]
+        metrics = {'counters': {'map_output_records': 10}, 'timings': {'map': 0.5}, 'user': {'lines': 3}}
+        self.jt.mapping_done(worker, task_id, path, {}, metrics)
+        self.jt.mapping_done(worker, task_id, path, {}, metrics)
+        self.jt.mapping_done(assignments[1][0], task_id, assignments[1][1])
+
+        r = self.jt.get_metrics(task_id)
+        self.assertEqual({'maps': 2, 'map_output_records': 10}, r['counters'])
+        self.assertEqual({'map': 0.5}, r['timings']['map'])
+        self.assertEqual({'lines': 3}, r['user'])
+        self.assertEqual(Status.not_found, self.jt.get_metrics("unknown")['status'])
+
+    def test_unknown_task(self):
+        not_found = {'status': Status.not_found}
+        self.assertEqual(not_found, self.jt.get_status("unknown"))
+        self.assertEqual(not_found, self.jt.wait_status("unknown", TaskStatus.mapping, 0))
+        self.assertEqual(not_found, self.jt.get_result("unknown"))
+        self.assertEqual(not_found, self.jt.wait_result("unknown", 0, 0))
+        self.assertEqual(not_found, self.jt.get_compression("unknown"))
+
+    def test_local_chunk_first(self):
+        self.jt.dfs.chunks = {"/in/a": "http://10.0.1.5:8888", "/in/b": "http://10.0.1.2:8888"}
+        task_id, task, assignments = self.start_task()
+
+        self.assertListEqual([(self.workers[0], "/in/a"), (self.workers[1], "/in/b")], assignments)
+        self.assertEqual(1, task.local_maps)
+        self.assertEqual(1, task.remote_maps)
+
+    def test_remote_chunk_after_locality_delay(self):
+        self.jt.dfs.chunks = {"/in/a": "http://10.0.1.3:8888"}
+        task_id = self.jt.create_task("/in", "/script.py")
+        task = self.jt.tasks[task_id]
+        self.assertListEqual([], self.beat(self.workers[0]))
+
+        task.get_chunk("/in/a").pending_since -= self.jt.locality_delay
+        self.assertListEqual([(task_id, "/in/a")], self.beat(self.workers[0]))
+        self.assertEqual(1, task.remote_maps)
+
+    def test_fair_share_of_workers(self):
+        task_id, task, assignments = self.start_task()
+        other_id = self.jt.create_task("/in", "/script.py")
+        self.jt.mapping_done(assignments[0][0], task_id, assignments[0][1])
+
+        self.assertListEqual([other_id], [a[0] for a in self.beat(assignments[0][0])])
+
+    def test_priority_share(self):
+        self.jt.dfs.chunks = {"/in/" + str(i): "" for i in range(10)}
+        low_id = self.jt.create_task("/in", "/script.py", False, 1)
+        high_id = self.jt.create_task("/in", "/script.py", False, 2)
+
+        self.assertListEqual([high_id, low_id, high_id], [a[0] for a in self.beat(self.workers[0], 3)])
+
+    def test_admission_queue(self):
+        self.jt.max_running_tasks = 1
+        self.jt.max_failures = 1
+        task_id, task, assignments = self.start_task()
+        low_id = self.jt.create_task("/in", "/script.py", False, 1)
+        high_id = self.jt.create_task("/in", "/script.py", False, 2)
+        self.assertEqual(TaskStatus.queued, self.jt.get_status(low_id))
+        self.assertEqual(TaskStatus.queued, self.jt.get_status(high_id))
+
+        self.jt.mapping_failed(assignments[0][0], task_id, assignments[0][1])
+        self.assertEqual(TaskStatus.failed, task.status)
+        self.assertEqual(TaskStatus.mapping, self.jt.get_status(high_id))
+        self.assertEqual(TaskStatus.queued, self.jt.get_status(low_id))
+
+    # JT which restores tasks from the journal of the given one
+    def restart(self, jt):
+        jt.journal.close()
+        restarted = JobTracker(dump_on=True, dfs=jt.dfs)
+        restarted.dump_path = jt.dump_path
+        restarted._load_dump()
+        return restarted
+
+    def test_recover_from_journal(self):
+        with tempfile.TemporaryDirectory() as d:
+            self.jt.dump_on = True
+            self.jt.dump_path = os.path.join(d, "journal")
+            self.jt._load_dump()
+            task_id, task, assignments = self.start_task()
+            for worker, path in assignments[:2]:
+                self.jt.mapping_done(worker, task_id, path)
+
+            with open(self.jt.dump_path, 'a') as f:
+                f.write('{"op": "map", "task_')
+            jt = self.restart(self.jt)
+            task = jt.tasks[task_id]
+            self.assertEqual(TaskStatus.mapping, task.status)
+            self.assertListEqual([[w, [p]] for w, p in assignments[:2]], task.mappers())
+            self.assertListEqual([p for w, p in assignments[2:]] + ["/in/3"], list(task.pending))
+            self.assertIn(assignments[0][0], jt.workers)
+
+            for worker, path in assignments[2:] + [(self.workers[0], "/in/3")]:
+                jt.mapping_done(worker, task_id, path)
+            jt.reducing_done(self.workers[0], task_id, 2, "/r/2")
+            jt = self.restart(jt)
+            self.assertEqual(TaskStatus.reducing, jt.get_status(task_id))
+            self.assertListEqual(["", "/r/2", ""], jt.get_result(task_id))
+            self.assertIsNotNone(jt.tasks[task_id].get_region_to_process())
+
+            for region in (1, 3):
+                jt.reducing_done(self.workers[0], task_id, region, "/r/" + str(region))
+            self.assertEqual(TaskStatus.task_done, jt.get_status(task_id))
+            jt = self.restart(jt)
+            self.assertNotIn(task_id, jt.tasks)
+            jt.journal.close()
+
+    def test_compact_journal_and_expire_finished_tasks(self):
+        with tempfile.TemporaryDirectory() as d:
+            self.jt.dump_on = True
+            self.jt.dump_path = os.path.join(d, "journal")
+            self.jt._load_dump()
+            done_id = self.jt.create_task("/in", "/script.py")
+            running_id = self.jt.create_task("/in", "/script.py")
+            with self.jt.lock:
+                self.jt._finish_task(done_id, TaskStatus.task_done)
+                self.jt._compact()
+            with open(self.jt.dump_path) as f:
+                self.assertSetEqual({running_id}, set(json.loads(line)['task_id'] for line in f))
+
+            self.jt.tasks[done_id].finished -= self.jt.finished_ttl
+            with self.jt.lock:
+                self.jt._expire_finished_tasks()
+            self.assertListEqual([running_id], list(self.jt.tasks))
+            self.jt.journal.close()
+
+    def test_failed_sampling_falls_back_to_hash(self):
+        for i in range(2):
+            self.jt.heartbeat("http://127.0.0.1:" + str(i + 1))
+        task_id = self.jt.create_task("/in", "/script.py", True)
+
+        self.assertEqual(TaskStatus.mapping, self.jt.wait_status(task_id, TaskStatus.sampling, 5))
+        self.assertIsNone(self.jt.tasks[task_id].split_points)
+
+
+if __name__ == '__main__':
+    unittest.main()
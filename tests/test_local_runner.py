@@ -0,0 +1,47 @@
+import unittest
+import os
+import tempfile
+from local_runner import LocalRunner
+
+
+class TestLocalRunner(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        with open(self.dir.name + "/a.txt", "w") as f:
+            f.write("aa bb\ncc aa\n" * 50)
+        with open(self.dir.name + "/b.txt", "w") as f:
+            f.write("bb zz")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_word_count(self):
+        runner = LocalRunner("map_libs/word_count.py", rds_count=3, processes=1, chunk_size=64)
+        r = sorted(runner.run(self.dir.name))
+        self.assertListEqual([('aa', 100), ('bb', 51), ('cc', 50), ('zz', 1)], r)
+
+    def test_word_count_in_pool(self):
+        runner = LocalRunner("map_libs/word_count.py", rds_count=2, processes=2)
+        r = sorted(runner.run(self.dir.name + "/b.txt"))
+        self.assertListEqual([('bb', 1), ('zz', 1)], r)
+
+    def test_counters_of_script(self):
+        script = os.path.join(self.dir.name, "lines.py")
+        with open(script, "w") as f:
+            f.write("class Mapper:\n"
+                    "    def run_map(self, data):\n"
+                    "        for line in data.splitlines():\n"
+                    "            self.counters.increment('lines')\n"
+                    "            yield line, 1\n"
+                    "Aggregate = 'sum'\n")
+        runner = LocalRunner(script, rds_count=2, processes=1, chunk_size=64)
+        runner.run(self.dir.name + "/a.txt")
+
+        self.assertEqual(100, runner.metrics.user['lines'])
+        self.assertEqual(100, runner.metrics.counters['map_output_records'])
+        self.assertEqual(2, runner.metrics.counters['reduce_output_records'])
+        self.assertIn("map", runner.metrics.timings)
+
+
+if __name__ == '__main__':
+    unittest.main()
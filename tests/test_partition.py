@@ -1,26 +1,33 @@
 import unittest
-from mapper import Mapper
+import tempfile
+from collector import OutputCollector
+from serialization import BinarySerializer
 from hash_partitioner import HashPartitioner
+from total_order_partitioner import TotalOrderPartitioner, KeySampler, compute_split_points
 
 
 class TestPartition(unittest.TestCase):
 
+    # partition tuples as map output is partitioned on emit
+    # Return dict {region number: sorted tuples of the region}
     @staticmethod
-    def create_map():
-        return Mapper({"jt_addr": "http://localhost:11111", "base_dir": "/tmp/tst"}, None, "addr", "map")
+    def partition(partitioner, rds_count, tuples):
+        with tempfile.TemporaryDirectory() as d:
+            c = OutputCollector(rds_count, partitioner, BinarySerializer(), d)
+            for t in tuples:
+                c.emit(t[0], t[1])
+            return {r: list(c.merge(r)) for r in range(1, rds_count + 1)}
 
     def test_partition_for_one(self):
-        m = self.create_map()
         tuples = [('aa', 1), ('bb', 1), ('cc', 1)]
-        r = m.partition(1, tuples)
+        r = self.partition(HashPartitioner(), 1, tuples)
 
         e = {1: [('aa', 1), ('bb', 1), ('cc', 1)]}
         self.assertDictEqual(e, r)
 
     def test_partition_for_two(self):
-        m = self.create_map()
         tuples = [('mm', 1), ('cc', 1), ('bb', 1), ('aa', 1), ('mm', 1)]
-        r = m.partition(2, tuples)
+        r = self.partition(HashPartitioner(), 2, tuples)
 
         e = {1: [('bb', 1)],
              2: [('aa', 1), ('cc', 1), ('mm', 1), ('mm', 1)]
@@ -29,9 +36,8 @@ class TestPartition(unittest.TestCase):
         self.assertDictEqual(e, r)
 
     def test_partition_for_tree(self):
-        m = self.create_map()
         tuples = [('nlll', 1), ('moscow', 1), ('innopolis', 1), ('kazan', 1)]
-        r = m.partition(3, tuples)
+        r = self.partition(HashPartitioner(), 3, tuples)
 
         e = {1: [('innopolis', 1)],
              2: [('moscow', 1)],
@@ -46,5 +52,50 @@ class TestPartition(unittest.TestCase):
         self.assertEquals(1, p.get_partition("moasold", 1, 3))
         self.assertEquals(1, p.get_partition("bbsa", 1, 4))
 
+    def test_crc32_partitioning(self):
+        p = HashPartitioner("crc32")
+        self.assertEqual(1, p.get_partition("aa", 1, 3))
+        self.assertEqual(2, p.get_partition(("moasold", 2016), 1, 3))
+        self.assertEqual(p.get_partition("bbsa", 1, 4), p.get_partition(b"bbsa", 1, 4))
+
+    def test_partition_batch(self):
+        keys = ["aa", "moasold", "bbsa", "innopolis", 2016]
+        for algorithm in ["legacy", "crc32"]:
+            p = HashPartitioner(algorithm)
+            self.assertListEqual([p.get_partition(k, 1, 3) for k in keys], p.partition_batch(keys, 3))
+
+    def test_total_order_partitioning(self):
+        p = TotalOrderPartitioner(["cc", "mm"])
+        self.assertListEqual([0, 1, 1, 2, 2], p.partition_batch(["aa", "cc", "kk", "mm", "zz"], 3))
+        self.assertEqual(1, p.get_partition("zz", 1, 2))
+
+    def test_total_order_tuple_keys(self):
+        p = TotalOrderPartitioner([["b", 1]])
+        self.assertEqual(0, p.get_partition(("a", 5), 1, 2))
+        self.assertEqual(1, p.get_partition(("b", 1), 1, 2))
+
+    def test_split_points(self):
+        keys = ["d", "a", "h", "b", "e", "c", "g", "f"]
+        self.assertListEqual(["c", "e", "g"], compute_split_points(keys, 4))
+        self.assertListEqual([], compute_split_points([], 4))
+
+    def test_map_with_total_order(self):
+        p = TotalOrderPartitioner(compute_split_points(["aa", "bb", "cc", "mm"], 2))
+        r = self.partition(p, 2, [('mm', 1), ('cc', 1), ('bb', 1), ('aa', 1), ('mm', 1)])
+
+        e = {1: [('aa', 1), ('bb', 1)],
+             2: [('cc', 1), ('mm', 1), ('mm', 1)]
+             }
+        self.assertDictEqual(e, r)
+
+    def test_key_sampler(self):
+        s = KeySampler(10)
+        for i in range(1000):
+            s.emit(i, 1)
+
+        self.assertEqual(1000, s.count)
+        self.assertEqual(10, len(s.keys))
+        self.assertTrue(all(0 <= k < 1000 for k in s.keys))
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,23 @@
 import unittest
+import tempfile
+import threading
 from map_libs.word_count import Reducer
+from reducer import merge_sorted, group_sorted, RunMerger, ReduceTask
+import reducer
+from serialization import BinarySerializer
+from slots import SlotExecutor
+from enums import ReduceStatus
+
+
+# mapper client which holds output of every chunk in one region
+class ChunksMapperClient:
+    def __init__(self, data):
+        self.data = data
+        self.loaded = []
+
+    def load_mapped_data(self, map_addr, task_id, region, chunk_paths=None):
+        self.loaded.extend(chunk_paths)
+        return merge_sorted([self.data[path] for path in chunk_paths])
 
 
 class TestReducers(unittest.TestCase):
@@ -22,5 +40,44 @@ class TestReducers(unittest.TestCase):
         e = [('a', 3), ('cc', 1), ('dd', 2), ('zz', 2)]
         self.assertListEqual(e, r.run_reduce(data))
 
+    def test_reduce_merged_groups(self):
+        streams = [[('a', 1), ('cc', 1), ('dd', 1)], [('a', 1), ('a', 1), ('zz', 1)], [], [('dd', 1), ('zz', 1)]]
+        r = Reducer()
+
+        e = [('a', 3), ('cc', 1), ('dd', 2), ('zz', 2)]
+        self.assertListEqual(e, r.run_reduce_groups(group_sorted(merge_sorted(streams))))
+
+    def test_merge_arrived_streams(self):
+        with tempfile.TemporaryDirectory() as d:
+            merger = RunMerger(BinarySerializer(), d, 2)
+            for stream in [[('a', 1), ('dd', 1)], [('cc', 1)], [('a', 1), ('zz', 1)]]:
+                merger.add(iter(stream))
+
+            self.assertEqual(1, len(merger.runs))
+            paths = merger.paths()
+            self.assertEqual(2, len(paths))
+            e = [('a', 1), ('a', 1), ('cc', 1), ('dd', 1), ('zz', 1)]
+            self.assertListEqual(e, list(merge_sorted([BinarySerializer().load(p) for p in paths])))
+
+    def test_fetch_announced_map_outputs(self):
+        data = {'c1': [('a', 1), ('b', 1)], 'c2': [('a', 1)], 'c3': [('c', 1)]}
+        client = ChunksMapperClient(data)
+        with tempfile.TemporaryDirectory() as d:
+            r = reducer.Reducer(None, "r", "http://localhost:1", {'jt_addr': "http://localhost:1", 'base_dir': d},
+                                client, SlotExecutor(1, 1, "thread"))
+            task = ReduceTask("t", 1, [["m1", ["c1"]]], "/reduce.py", False)
+            r.running[("t", 1)] = task
+
+            loading = threading.Thread(target=lambda: setattr(task, 'paths', r._load_data_from_mappers(task)))
+            loading.start()
+            r.add_map_outputs("t", [["m1", ["c1"]], ["m2", ["c2"]]], False)
+            r.add_map_outputs("t", [["m1", ["c1", "c3"]], ["m2", ["c2"]]], True)
+            loading.join(5)
+
+            self.assertEqual(ReduceStatus.data_loaded, task.status)
+            self.assertListEqual(['c1', 'c2', 'c3'], sorted(client.loaded))
+            e = [('a', 1), ('a', 1), ('b', 1), ('c', 1)]
+            self.assertListEqual(e, list(merge_sorted([BinarySerializer().load(p) for p in task.paths])))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import tempfile
+from enums import Status
+from script_cache import ScriptCache, LRUCache, load_module
+
+
+# DFS with scripts which counts downloads
+class ScriptsFS:
+    def __init__(self, scripts):
+        self.scripts = scripts
+        self.downloads = 0
+
+    def download_to(self, v_path, l_path):
+        if v_path not in self.scripts:
+            return {'status': Status.not_found}
+
+        self.downloads += 1
+        with open(l_path, 'w') as f:
+            f.write(self.scripts[v_path])
+        return {'status': Status.ok}
+
+
+class TestScriptCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.fs = ScriptsFS({"/a.py": "loads = []\n", "/b.py": "loads = []\n", "/c.py": "x = 1\n"})
+        self.cache = ScriptCache(self.fs, self.dir.name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_download_once_per_task(self):
+        script = self.cache.get("t1", "/a.py")
+        self.assertIs(script, self.cache.get("t1", "/a.py"))
+        self.assertEqual(1, self.fs.downloads)
+
+        self.assertEqual(script.path, self.cache.get("t2", "/b.py").path)
+        self.assertEqual(2, self.fs.downloads)
+        self.assertIsNone(self.cache.get("t1", "/none.py"))
+
+    def test_module_is_loaded_once(self):
+        mod = load_module(self.cache.get("t1", "/a.py"))
+        mod.loads.append(1)
+        self.assertIs(mod, load_module(self.cache.get("t2", "/a.py")))
+        self.assertIsNot(mod, load_module(self.cache.get("t1", "/b.py")))
+        self.assertEqual(1, load_module(self.cache.get("t1", "/c.py")).x)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertListEqual(["a", "c"], list(cache.items))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import pickle
+import struct
+from serialization import BinarySerializer, JsonSerializer, get_serializer, compressed, compression_stats
+
+
+class TestSerialization(unittest.TestCase):
+    def test_binary_keeps_types(self):
+        s = BinarySerializer()
+        data = [(2015, 31.2), (('a', 1), [1, 2]), ("мир", None), (b"raw", 1)]
+        self.assertListEqual(data, list(s.loads(s.dumps(data))))
+
+    def test_binary_nested_values(self):
+        s = BinarySerializer()
+        data = [(1 << 70, {'a': [True, False]}), (-5, (1.5, "\udc80")), ((), [])]
+        self.assertListEqual(data, list(s.loads(s.dumps(data))))
+        self.assertRaises(TypeError, s.dumps, [("a", object())])
+
+    # payloads of other workers are decoded without running code
+    def test_binary_rejects_pickle(self):
+        record = pickle.dumps(("a", 1))
+        payload = struct.pack(">I", len(record)) + record
+        self.assertRaises(ValueError, list, BinarySerializer().loads(payload))
+
+    def test_json_round_trip(self):
+        s = JsonSerializer()
+        data = [("aa", 1), ("bb", 2.5)]
+        self.assertListEqual(data, list(s.loads(s.dumps(data))))
+
+    def test_empty_stream(self):
+        s = BinarySerializer()
+        self.assertListEqual([], list(s.loads(s.dumps([]))))
+
+    def test_get_serializer(self):
+        self.assertIsInstance(get_serializer("binary"), BinarySerializer)
+        self.assertRaises(ValueError, get_serializer, "xml")
+        self.assertRaises(ValueError, get_serializer, "binary+zip")
+
+    def test_compressed_round_trip(self):
+        data = [("word", 1)] * 1000
+        for codec in ("zlib", "lzma:1", "bz2:9"):
+            s = compressed(JsonSerializer(), codec)
+            payload = s.dumps(data)
+            self.assertListEqual(data, list(get_serializer(s.name).loads(payload)))
+
+            stats = compression_stats(s)
+            self.assertEqual(len(payload), stats['stored'])
+            self.assertLess(stats['stored'] * 5, stats['raw'])
+
+        self.assertIsNone(compression_stats(compressed(BinarySerializer(), None)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import tempfile
+import http.client
+from mapper import Mapper, MapTask
+from reducer import HTTPMapperClient
+from shuffle_server import ShuffleServer
+from collector import OutputCollector
+from enums import MapStatus
+
+
+class TestShuffle(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.mapper = Mapper({"jt_addr": "http://localhost:11111", "base_dir": self.dir.name + "/"}, None, "map", "map")
+        self.server = ShuffleServer(self.mapper, "localhost", 0)
+        self.port = self.server.server.server_address[1]
+        self.server.start()
+
+        self.save_chunk("/in/chunk_0", [('aa', 1), ('cc', 1), ('mm', 1)])
+        self.save_chunk("/in/chunk_1", [('bb', 1), ('mm', 1)])
+
+    def tearDown(self):
+        self.server.stop()
+        self.dir.cleanup()
+
+    def save_chunk(self, chunk_path, tuples):
+        task = MapTask("task", 1, chunk_path, "/script.py")
+        collector = OutputCollector(1, self.mapper.hasher, self.mapper.serializer, self.dir.name + "/spill")
+        for t in tuples:
+            collector.emit(t[0], t[1])
+        collector.save(self.mapper._get_chunk_dir_path("task", chunk_path))
+        task.status = MapStatus.finished
+        self.mapper.tasks.setdefault("task", {})[chunk_path] = task
+
+    def test_load_region(self):
+        cl = HTTPMapperClient(self.dir.name + "/reduce", self.port)
+        r = list(cl.load_mapped_data("http://localhost:8888", "task", 1))
+        self.assertListEqual([('aa', 1), ('bb', 1), ('cc', 1), ('mm', 1), ('mm', 1)], r)
+
+    def test_load_chunks_mapped_later(self):
+        self.mapper.tasks["task"]["/in/chunk_0"].status = MapStatus.chunk_loaded
+        cl = HTTPMapperClient(self.dir.name + "/reduce", self.port)
+        first = cl.load_mapped_data("http://localhost:8888", "task", 1, ["/in/chunk_1"])
+
+        self.mapper.tasks["task"]["/in/chunk_0"].status = MapStatus.finished
+        second = cl.load_mapped_data("http://localhost:8888", "task", 1, ["/in/chunk_0"])
+        self.assertListEqual([('bb', 1), ('mm', 1)], list(first))
+        self.assertListEqual([('aa', 1), ('cc', 1), ('mm', 1)], list(second))
+
+    def test_unknown_chunk(self):
+        conn = http.client.HTTPConnection("localhost", self.port)
+        conn.request("GET", "/task/1?chunk=..%2F..%2Fetc")
+        self.assertEqual(404, conn.getresponse().status)
+        conn.close()
+
+    def test_range_request(self):
+        conn = http.client.HTTPConnection("localhost", self.port)
+        conn.request("GET", "/task/1?chunk=%2Fin%2Fchunk_0")
+        full = conn.getresponse().read()
+
+        conn.request("GET", "/task/1?chunk=%2Fin%2Fchunk_0", headers={"Range": "bytes=4-"})
+        r = conn.getresponse()
+        self.assertEqual(206, r.status)
+        self.assertEqual(full[4:], r.read())
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from slots import SlotExecutor
+
+
+class TestSlots(unittest.TestCase):
+    def test_bounded_map_slots(self):
+        slots = SlotExecutor(2, 1, "thread")
+        release = threading.Event()
+        started = threading.Semaphore(0)
+
+        def task():
+            started.release()
+            release.wait()
+
+        futures = [slots.submit_map(task) for _ in range(3)]
+        started.acquire()
+        started.acquire()
+        self.assertEqual(0, slots.free_map_slots)
+        self.assertEqual(1, slots.free_reduce_slots)
+
+        release.set()
+        for f in futures:
+            f.result()
+        self.assertEqual(2, slots.free_map_slots)
+        slots.shutdown()
+
+    def test_run_in_process(self):
+        slots = SlotExecutor(1, 1, "process")
+        self.assertEqual(10, slots.run(sum, [1, 2, 3, 4]))
+        slots.shutdown()
+
+    def test_replace_broken_process_pool(self):
+        slots = SlotExecutor(1, 1, "process")
+        self.assertRaises(BrokenProcessPool, slots.run, os._exit, 1)
+        self.assertEqual(3, slots.run(sum, [1, 2]))
+        slots.shutdown()
+
+    def test_unknown_isolation(self):
+        self.assertRaises(ValueError, SlotExecutor, 1, 1, "vm")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import bisect
+import random
+
+
+# xml-rpc transfers tuples as lists, turn them back to comparable tuples
+def _as_key(key):
+    if isinstance(key, list):
+        return tuple(_as_key(k) for k in key)
+    return key
+
+
+# Partitioner which keeps order between regions: every key of region i is less
+# than keys of region i + 1, so concatenated sorted regions are sorted globally.
+# split_points - sorted keys which separate regions, at most rds_count - 1 of them
+class TotalOrderPartitioner:
+    def __init__(self, split_points):
+        self.split_points = [_as_key(k) for k in split_points]
+
+    def get_partition(self, key, value, rds_count):
+        return min(bisect.bisect_right(self.split_points, key), rds_count - 1)
+
+    def partition_batch(self, keys, rds_count):
+        points = self.split_points
+        last = rds_count - 1
+        return [min(bisect.bisect_right(points, k), last) for k in keys]
+
+    # partitions of NumPy array of keys
+    def partition_array(self, keys, rds_count):
+        import numpy as np
+        if len(self.split_points) == 0:
+            return np.zeros(len(keys), dtype=np.intp)
+        parts = np.searchsorted(np.array(self.split_points), keys, side='right')
+        return np.minimum(parts, rds_count - 1)
+
+
+# split points which divide sampled keys to rds_count regions of equal size
+def compute_split_points(keys, rds_count):
+    keys = sorted(_as_key(k) for k in keys)
+    if len(keys) == 0:
+        return []
+
+    points = []
+    for i in range(1, rds_count):
+        points.append(keys[i * len(keys) // rds_count])
+
+    return points
+
+
+# collector which keeps uniform random sample of emitted keys (reservoir sampling)
+class KeySampler:
+    def __init__(self, sample_size):
+        self.sample_size = sample_size
+        self.count = 0
+        self.keys = []
+
+    def emit(self, key, value):
+        self.count += 1
+        if len(self.keys) < self.sample_size:
+            self.keys.append(key)
+        else:
+            i = random.randrange(self.count)
+            if i < self.sample_size:
+                self.keys[i] = key
+
+    # random keys of the batch are offered to the reservoir, so that only sample_size keys are converted
+    def emit_batch(self, keys, values):
+        n = len(keys)
+        picked = sorted(random.sample(range(n), min(n, self.sample_size)))
+        for key in keys[picked].tolist():
+            self.emit(key, None)
+        self.count += n - len(picked)
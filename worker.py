@@ -2,14 +2,16 @@
 from xmlrpc.server import SimpleXMLRPCServer
 from xmlrpc.client import ServerProxy
 from mapper import Mapper
-from reducer import Reducer, RPCMapperClient
+from reducer import Reducer, RPCMapperClient, HTTPMapperClient
+from shuffle_server import ShuffleServer
+from slots import SlotExecutor
+from script_cache import ScriptCache
+from urllib.parse import urlsplit
 import sys
 import socket
 import _thread
-import time
+import threading
 import cfg
-import fake_fs
-import yadfs.client.client
 
 
 class Worker:
@@ -19,22 +21,53 @@ class Worker:
         self.jt = ServerProxy(self.jt_addr)
         self.hb_timeout = 0.2  # heartbeat timeout in seconds
         self.on = True
-        self.mapper = Mapper(opts, fs, "map" + name, addr)
-        self.reducer = Reducer(fs, "reduce" + name, addr, opts, RPCMapperClient())
+        self.slots = SlotExecutor.from_opts(opts)
+        # heartbeat is sent right away when a slot is free, so that JT assigns new work without delay
+        self.wakeup = threading.Event()
+        self.slots.on_free = self.wakeup.set
+        scripts = ScriptCache(fs, opts["base_dir"] + "scripts" + name)
+        self.mapper = Mapper(opts, fs, "map" + name, addr, self.slots, scripts)
+        self.shuffle_port = int(opts.get("shuffle_port", 8889))
+        self.http_shuffle = opts.get("shuffle", "http") == "http"
+        if self.http_shuffle:
+            mapper_cl = HTTPMapperClient(opts["base_dir"] + "reduce" + name, self.shuffle_port)
+        else:
+            mapper_cl = RPCMapperClient()
+        self.reducer = Reducer(fs, "reduce" + name, addr, opts, mapper_cl, self.slots, scripts)
 
     def start(self):
         print('Init worker')
+        if self.http_shuffle:
+            host = urlsplit(self.addr).hostname
+            ShuffleServer(self.mapper, host, self.shuffle_port).start()
+            print('Shuffle server is listening on port', self.shuffle_port)
         print('Start sending heartbeats to', self.jt_addr)
         _thread.start_new_thread(self._heartbeat, ())
         print('Server is ready')
 
+    # heartbeat reports free slots and running tasks, JT responds with new tasks for free slots
     def _heartbeat(self):
         while self.on:
+            self.wakeup.clear()
             try:
-                self.jt.heartbeat(self.addr)
+                progress = self.mapper.get_progress() + self.reducer.get_progress()
+                r = self.jt.heartbeat(self.addr, self.get_slots(), progress)
+                for a in r['assignments']:
+                    self._start_assignment(a)
+                for m in r.get('map_outputs', []):
+                    self.reducer.add_map_outputs(m['task_id'], m['mappers'], m['maps_done'])
             except Exception as e:
                 print(e)
-            time.sleep(self.hb_timeout)
+            self.wakeup.wait(self.hb_timeout)
+
+    # a - task from heartbeat response of JT
+    def _start_assignment(self, a):
+        if a['kind'] == "map":
+            self.mapper.map(a['task_id'], a['rds_count'], a['chunk_path'], a['script'], False,
+                            a.get('split_points'), a.get('input_format'), a.get('codec'))
+        else:
+            self.reducer.reduce(a['task_id'], a['region'], a['mappers'], a['script'], a.get('maps_done', True),
+                                a.get('codec'))
 
     # map data by applying some data function
     # task_id - unique task_id
@@ -42,29 +75,45 @@ class Worker:
     # chunk_path - DFS path to the chunk file to map
     # map_script - DFS path to script of map function
     # restart_task - if True then restart map task even its already completed or executing now
-    def map(self, task_id, rds_count, chunk_path, map_script, restart_task=False):
-        return self.mapper.map(task_id, rds_count, chunk_path, map_script, restart_task)
+    # split_points - keys separating regions for total order partitioning, hash partitioning if None
+    # input_format - name of input format, the whole chunk is mapped if None
+    # codec - spec of codec which compresses map output, not compressed if None
+    def map(self, task_id, rds_count, chunk_path, map_script, restart_task=False, split_points=None,
+            input_format=None, codec=None):
+        return self.mapper.map(task_id, rds_count, chunk_path, map_script, restart_task, split_points, input_format,
+                               codec)
+
+    # sample keys emitted by map script for the chunk
+    def sample(self, task_id, chunk_path, map_script, sample_size, input_format=None):
+        return self.mapper.sample(task_id, chunk_path, map_script, sample_size, input_format)
 
     # get status of task execution for the current task
     def get_status(self, task_id, chunk_path):
         return self.mapper.get_status(task_id, chunk_path)
 
+    # number of free map and reduce slots of the worker
+    def get_slots(self):
+        return {'map': self.slots.free_map_slots, 'reduce': self.slots.free_reduce_slots}
+
     # read mapped data for specific region
     # task_id - unique task_id
     # region - is a integer region which is specified for the current reducer
+    # chunk_paths - chunks whose output is read, all chunks of the task if None
     # Return dict {status: Status.ok, data: list of tuples}
     # if file not exists then status = Status.not_found
     # if file is empty then returns ok and empty list
-    def read_mapped_data(self, task_id, region_number):
-        return self.mapper.read_mapped_data(task_id, region_number)
+    def read_mapped_data(self, task_id, region_number, chunk_paths=None):
+        return self.mapper.read_mapped_data(task_id, region_number, chunk_paths)
 
     # signal from JT for starting reducing
     # task_id - unique task_id
     # region for which reducer is responsible
-    # mappers which contain data for current task
+    # mappers which contain data for current task, address or [address, list of chunk paths]
     # path in DFS to files
-    def reduce(self, task_id, region, mappers, script_path):
-        return self.reducer.reduce(task_id, region, mappers, script_path)
+    # maps_done - False if outputs of the rest of maps come later in heartbeat responses
+    # codec - spec of codec which compresses merged runs and the result
+    def reduce(self, task_id, region, mappers, script_path, maps_done=True, codec=None):
+        return self.reducer.reduce(task_id, region, mappers, script_path, maps_done, codec)
 
 if __name__ == '__main__':
     # port = int(sys.argv[1])
@@ -77,7 +126,7 @@ if __name__ == '__main__':
     port = 8888
     addr = 'http://' + host + ":" + str(port)
 
-    fs = yadfs.client.client.Client()
+    fs = cfg.create_fs(opts)
     worker = Worker(fs, str(port), addr, opts)
     worker.start()
 
@@ -2,28 +2,42 @@
 
 import click
 import os
-import time
 import json
+import base64
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from xmlrpc.client import ServerProxy
 
 import sys
 from os.path import dirname
-from enums import TaskStatus
+import cfg
+from enums import TaskStatus, Status
+from serialization import codecs, get_codec
+from local_runner import LocalRunner
 
 sys.path.append(dirname(dirname(__file__)))
-import yadfs.client.client
-import yadfs.utils.enums
 
 
 class Client:
+    # file system is selected by config given in YAMR_CONF, DFS if it is not set
     def __init__(self):
-        self.fs = yadfs.client.client.Client()
+        opts = cfg.load(os.environ['YAMR_CONF']) if os.getenv('YAMR_CONF') else {}
+        self.fs = cfg.create_fs(opts)
         if not os.getenv('YAMR_JT'):
             os.environ['YAMR_JT'] = 'http://localhost:11111'
-        self.jt = ServerProxy(os.environ['YAMR_JT'])
+        self.jt_addr = os.environ['YAMR_JT']
+        self.jt = ServerProxy(self.jt_addr)
 
-    def start_task(self, inp, script):
-        return self.jt.create_task(inp, script)
+    # priority - weight of the task in fair share of workers and in the admission queue
+    # input_format - lines, json_lines or fixed:<record size>[:<chunk size>], map gets whole chunks if None
+    # codec - zlib, lzma or bz2 with optional level, e.g. zlib:9, compresses intermediate data and the result
+    def start_task(self, inp, script, total_order=False, priority=1, input_format=None, codec=None):
+        return self.jt.create_task(inp, script, total_order, priority, input_format or "", codec or "")
+
+    def get_compression(self, task_id):
+        return self.jt.get_compression(task_id)
+
+    def get_metrics(self, task_id):
+        return self.jt.get_metrics(task_id)
 
     def upload(self, path, remote_path):
         return self.fs.create_file(path, remote_path)
@@ -31,12 +45,75 @@ class Client:
     def get_status(self, task_id):
         return self.jt.get_status(task_id)
 
+    # block until status of the task is changed
+    def wait_status(self, task_id, status, timeout=10):
+        return self.jt.wait_status(task_id, status, timeout)
+
     def get_result(self, task_id):
         return self.jt.get_result(task_id)
 
     def get_file(self, path):
         return self.fs.get_file_content(path)
 
+    # block until more than known regions are reduced or the task is finished
+    # own proxy, so it can be called from a thread while the client is used
+    def wait_result(self, task_id, known, timeout=10):
+        return ServerProxy(self.jt_addr).wait_result(task_id, known, timeout)
+
+    # Return records of the result of a region, compressed result has extension of its codec
+    def load_region(self, path):
+        part = self.get_file(path)
+        if part[1] is None:
+            raise Exception("Failed to load result " + path + ": " + str(part))
+        ext = os.path.splitext(path)[1][1:]
+        if ext in codecs:
+            return json.loads(get_codec(ext).decompress(base64.b64decode(part[1])).decode('utf-8'))
+        return json.loads(part[1])
+
+    # generator of result records of the task, waits for the task to finish
+    # regions are loaded by fetchers threads as soon as they are reduced and their records are
+    # yielded before the rest of regions are done, in order of regions if ordered
+    # Raise Exception if the task fails
+    def stream_result(self, task_id, ordered=False, fetchers=4, timeout=10):
+        loads = {}  # region index -> future of its records
+        yielded = set()
+        regions = None
+        status = None
+        watch = None
+        with ThreadPoolExecutor(fetchers + 1) as pool:
+            while True:
+                if watch is not None and watch.done():
+                    r = watch.result()
+                    watch = None
+                    status = r['status']
+                    if status == Status.not_found:
+                        raise Exception("Task " + task_id + " is not found")
+                    if status == TaskStatus.failed:
+                        raise Exception("Task " + task_id + " failed")
+                    regions = len(r['result'])
+                    for i, path in enumerate(r['result']):
+                        if path != "" and i not in loads:
+                            loads[i] = pool.submit(self.load_region, path)
+                if watch is None and status != TaskStatus.task_done:
+                    watch = pool.submit(self.wait_result, task_id, len(loads), timeout)
+
+                ready = sorted(i for i, f in loads.items() if i not in yielded and f.done())
+                if ordered:
+                    ready = [i for n, i in enumerate(ready) if i == len(yielded) + n]
+                for i in ready:
+                    yielded.add(i)
+                    records = loads[i].result()
+                    loads[i] = None  # records of the region are not kept after they are yielded
+                    yield from records
+
+                if status == TaskStatus.task_done and len(yielded) == regions:
+                    return
+                waiting = [f for f in loads.values() if f is not None and not f.done()]
+                if watch is not None:
+                    waiting.append(watch)
+                if len(ready) == 0 and len(waiting) > 0:
+                    wait(waiting, return_when=FIRST_COMPLETED)
+
     def list_dir(self, path):
         return self.fs.list_dir(path)
 
@@ -51,58 +128,81 @@ def cli(ctx):
 @cli.command()
 @click.argument('path')
 @click.argument('script')
-def start_task(path, script):
+@click.option('--total-order', is_flag=True, help='Sort result globally')
+@click.option('--priority', type=int, default=1, help='Share of workers relative to other tasks')
+@click.option('--input-format', default=None,
+              help='Split chunks into records: lines, json_lines or fixed:<record size>[:<chunk size>]')
+@click.option('--codec', default=None, help='Compress intermediate data and result: zlib, lzma or bz2[:level]')
+@click.option('--fetchers', type=int, default=4, help='Number of regions loaded concurrently')
+def start_task(path, script, total_order, priority, input_format, codec, fetchers):
     """Start new task"""
     cl = Client()
-    task_id = cl.start_task(path, script)
-    status = cl.get_status(task_id)
-    while status != TaskStatus.task_done:
-        time.sleep(0.5)
-        status = cl.get_status(task_id)
-
-    res = cl.get_result(task_id)
-
-    data = []
-
-    for path in res:
-        data.append(cl.get_file(path))
-
-    result = []
-    for part in data:
-        if part[1] is not None:
-            result.extend(json.loads(part[1]))
-        else:
-            print(part)
-
-    for t in result:
-        print(str(t[0]) + ": " + str(t[1]))
+    task_id = cl.start_task(path, script, total_order, priority, input_format, codec)
+    # globally sorted result is printed in order of regions, otherwise regions are printed as they are done
+    print_result(cl.stream_result(task_id, total_order, fetchers))
 
 
 @cli.command()
 @click.argument('task_id')
-def task_result(task_id):
+@click.option('--fetchers', type=int, default=4, help='Number of regions loaded concurrently')
+def task_result(task_id, fetchers):
     """Show result of a task"""
     cl = Client()
+    # JT gives results of regions in order of their numbers
+    print_result(cl.stream_result(task_id, True, fetchers))
 
-    path = "/" + task_id + "/result/"
 
-    paths = cl.list_dir(path)
+@cli.command()
+@click.argument('task_id')
+def compression(task_id):
+    """Show bytes saved by the codec of a task"""
+    r = Client().get_compression(task_id)
+    if r.get('status') == Status.not_found:
+        print("task " + task_id + " is not found", file=sys.stderr)
+        sys.exit(1)
+    print("codec: " + (r['codec'] or "none"))
+    print("map output: %d -> %d bytes" % (r['map_raw'], r['map_stored']))
+    print("result: %d -> %d bytes" % (r['result_raw'], r['result_stored']))
+    print("saved: %d bytes" % r['saved'])
 
-    data = []
 
-    for _, item in paths['items'].items():
-        path = item['path']
-        print(path)
-        data.append(cl.get_file(path))
+@cli.command()
+@click.argument('task_id')
+def metrics(task_id):
+    """Show counters and phase timings of a task"""
+    r = Client().get_metrics(task_id)
+    if r['status'] != Status.ok:
+        print("task " + task_id + " is not found", file=sys.stderr)
+        sys.exit(1)
+    print("elapsed: %.3f s" % r['elapsed'])
+    for name, value in sorted(r['counters'].items()):
+        print("%s: %d" % (name, value))
+    for kind, timings in sorted(r['timings'].items()):
+        for phase, seconds in sorted(timings.items()):
+            print("%s.%s: %.3f s" % (kind, phase, seconds))
+    for name, value in sorted(r['user'].items()):
+        print("user.%s: %d" % (name, value))
+
+
+# failed task or region which can not be loaded ends the command with exit status 1
+def print_result(records):
+    try:
+        for t in records:
+            print(str(t[0]) + ": " + str(t[1]))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
 
-    result = []
-    for part in data:
-        if part[1] is not None:
-            result.extend(json.loads(part[1]))
-        else:
-            print(part)
 
-    for t in result:
+@cli.command()
+@click.argument('path')
+@click.argument('script')
+@click.option('--reducers', type=int, default=None, help='Number of regions')
+@click.option('--processes', type=int, default=None, help='Size of the process pool')
+def run_local(path, script, reducers, processes):
+    """Run task on local files without job tracker and DFS"""
+    runner = LocalRunner(script, reducers, processes)
+    for t in runner.run(path):
         print(str(t[0]) + ": " + str(t[1]))
 
 